@@ -1,31 +1,45 @@
 from ctypes import CDLL, c_size_t, c_char_p, c_char
-import asyncio
-from functools import partial, wraps
 from os import remove
 
+from backend.ioExecutor import IOExecutor, FOREGROUND, BACKGROUND
 
-# https://github.com/Tinche/aiofiles/blob/master/aiofiles/os.py
-def wrap(func):
-    @wraps(func)
-    async def run(*args, loop=None, executor=None, **kwargs):
-        if loop is None:
-            loop = asyncio.get_event_loop()
-        pfunc = partial(func, *args, **kwargs)
-        return await loop.run_in_executor(executor, pfunc)
-
-    return run
 
 class AsyncFiles:
-    def __init__(self, libPath: str):
-        extern = CDLL(libPath)
+    # The jobs run in the queue of the device of the file they write,
+    # see ioExecutor
+    def __init__(self, libPath: str, io: IOExecutor = None):
+        self.extern = CDLL(libPath)
+
+        self.extern.splitFile.restype = c_size_t
+        self.extern.splitFile.argtypes = [c_size_t, c_char_p, c_char_p,
+                                          c_size_t, c_size_t]
+
+        self.extern.concatFiles.restype = c_char
+        self.extern.concatFiles.argtypes = [c_char_p, c_char_p, c_size_t]
+
+        self.io = io if io else IOExecutor()
+
+
+    async def splitFile(self, startIndex: int, filePath: bytes, outFileName: bytes,
+                        mulChunkSize: int, bufSize: int,
+                        priority: int = BACKGROUND) -> int:
+        return await self.io.run(outFileName, self.extern.splitFile, startIndex,
+                                 filePath, outFileName, mulChunkSize, bufSize,
+                                 priority=priority)
+
+
+    async def concatFiles(self, filePath: bytes, outFileName: bytes, bufSize: int,
+                          priority: int = FOREGROUND):
+        return await self.io.run(outFileName, self.extern.concatFiles,
+                                 filePath, outFileName, bufSize, priority=priority)
+
 
-        extern.splitFile.restype = c_size_t
-        extern.splitFile.argtypes = [c_size_t, c_char_p, c_char_p,
-                                     c_size_t, c_size_t]
+    async def remove(self, filePath: str):
+        # removing is quick and frees space in tmp_path
+        await self.io.run(filePath, remove, filePath, priority=FOREGROUND)
 
-        extern.concatFiles.restype = c_char
-        extern.concatFiles.argtypes = [c_char_p, c_char_p, c_size_t]
 
-        self.splitFile = wrap(extern.splitFile)
-        self.concatFiles = wrap(extern.concatFiles)
-        self.remove = wrap(remove)
+    async def run(self, filePath: str, func: callable, *args,
+                  priority: int = BACKGROUND):
+        # any other blocking job that reads or writes filePath
+        return await self.io.run(filePath, func, *args, priority=priority)
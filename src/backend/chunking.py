@@ -0,0 +1,103 @@
+'''
+Chooses the size of the chunks every uploaded file is split in
+
+A chunk costs some time besides its bytes (splitting it, sending and
+getting its message), so small chunks are slower, but when a transfer
+fails the whole chunk has to be sent again, so big chunks cost more on a
+link that fails often. With T the throughput, o the cost of a chunk and
+p the failures per byte, the expected time of a file is lowest with chunks
+of sqrt(2*o*T/p) bytes.
+
+The throughput and failures are measured by the transfers and saved in
+data_path at most once every SAVE_EVERY seconds and when the program
+exits, failures are counted over roughly the last 50 chunks. The size
+is then evened out so all the chunks of a file have about the same size
+(a file a bit bigger than a chunk isn't split in a full chunk and a
+tiny one).
+
+The size is stored in the 'chunkSize' field of the database entry, files
+uploaded before it existed use DEFAULT_CHUNK_SIZE.
+'''
+
+from math import sqrt
+import time
+
+MAX_CHUNK_SIZE = 2000*1024*1024 # the biggest file telegram accepts
+DEFAULT_CHUNK_SIZE = MAX_CHUNK_SIZE
+MIN_CHUNK_SIZE = 64*1024*1024
+ALIGN = 1024*1024 # files are downloaded and split in pieces of up to 1 MiB
+CHUNK_OVERHEAD = 2.0 # seconds
+PRIOR_BYTES = 100*1024*1024*1024 # assume one failure every that many bytes
+SMOOTHING = 0.2 # of the throughput average
+DECAY = 0.98 # of the failure counts, for every measured chunk
+SAVE_EVERY = 60 # seconds
+
+
+def chunkSize(fileData: dict) -> int:
+    # the size of the chunks of an uploaded or resumed file
+    return fileData.get('chunkSize') or DEFAULT_CHUNK_SIZE
+
+
+class ChunkSizer:
+    def __init__(self, fixed: int = 0, stats: dict = None, save: callable = None):
+        stats = stats if stats else {}
+
+        self.fixed = fixed # chunk_size from the config, 0 measures it
+        self.throughput = stats.get('throughput', 10*1024*1024) # bytes per second
+        self.bytes = stats.get('bytes', 0)
+        self.failures = stats.get('failures', 0)
+        self.save = save # called with stats() by flush
+        self.saved = time.monotonic() # when save was last called
+        self.dirty = False # measured since the last save
+
+
+    def stats(self) -> dict:
+        return {'throughput' : self.throughput,
+                'bytes'      : self.bytes,
+                'failures'   : self.failures}
+
+
+    def record(self, size: int, seconds: float, failed: bool = False):
+        # Called after every chunk transfer
+        self.bytes *= DECAY
+        self.failures *= DECAY
+
+        if failed:
+            self.failures += 1
+        elif size and seconds > 0:
+            self.bytes += size
+            self.throughput += SMOOTHING * (size / seconds - self.throughput)
+
+        self.dirty = True
+        if time.monotonic() - self.saved >= SAVE_EVERY:
+            self.flush()
+
+
+    def flush(self):
+        # saves the measurements if they changed
+        if self.save and self.dirty:
+            self.save(self.stats())
+
+        self.saved = time.monotonic()
+        self.dirty = False
+
+
+    def failureRate(self) -> float:
+        # failures per byte
+        return (self.failures + 1) / (self.bytes + PRIOR_BYTES)
+
+
+    def choose(self, fileSize: int = None) -> int:
+        # The chunk size of a new upload, fileSize is None for streams
+        if self.fixed:
+            size = self.fixed
+        else:
+            size = sqrt(2 * CHUNK_OVERHEAD * self.throughput / self.failureRate())
+
+        size = min(max(int(size), MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+
+        if fileSize:
+            chunks = max(-(-fileSize // size), 1)
+            size = -(-fileSize // chunks)
+
+        return min(-(-size // ALIGN) * ALIGN, MAX_CHUNK_SIZE)
@@ -0,0 +1,46 @@
+'''
+Walks local directories for syncing them with the database
+
+The result of a scan maps the path of every file relative to the scanned
+directory ('/' separated) to its (size, mtime in ns, inode). It is saved
+as the scan cache after a sync, so the next sync only has to stat the files
+to know which ones changed.
+'''
+
+import os
+
+
+def scanDirectory(localPath: str) -> dict:
+    # os.scandir gets the file type without an extra stat call,
+    # symlinks are not followed
+    scan = {}
+    dirs = [('', localPath)]
+
+    while dirs:
+        relDir, absDir = dirs.pop()
+
+        with os.scandir(absDir) as it:
+            for entry in it:
+                relPath = relDir + '/' + entry.name if relDir else entry.name
+
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append((relPath, entry.path))
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    scan[relPath] = (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    return scan
+
+
+def changedFiles(scan: dict, cache: dict, useInode: bool = False) -> list:
+    # files that are new or have a different size, mtime or inode
+    # (only if useInode) than the last time they were synced
+    fields = 3 if useInode else 2
+    changed = []
+
+    for relPath, stat in scan.items():
+        cached = cache.get(relPath)
+        if not cached or cached[:fields] != stat[:fields]:
+            changed.append(relPath)
+
+    return changed
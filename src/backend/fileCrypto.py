@@ -0,0 +1,111 @@
+'''
+Client side encryption of the uploaded files with tgcrypto's AES-256-CTR
+
+CTR mode is used because any byte of a file can be encrypted or decrypted
+on its own by computing the counter for its offset, so range downloads,
+streaming and resuming don't need the rest of the file. The encrypted file
+has the same size as the original, so chunk boundaries don't change.
+
+Every file gets its own random key and iv, they are stored in its
+database entry.
+
+Buffers are split in segments that are encrypted by different threads,
+tgcrypto releases the GIL so they run on separate cores. Reading and
+writing the files goes through the IOExecutor queue of the device of the
+file that is written, like splitFile and concatFiles.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import os
+
+import tgcrypto
+
+from backend.ioExecutor import IOExecutor, FOREGROUND, BACKGROUND
+
+BLOCK_SIZE = 16
+SEGMENT_SIZE = 4*1024*1024 # encrypted by one thread, multiple of BLOCK_SIZE
+
+
+def newKey() -> tuple:
+    # returns a random key and iv
+    return os.urandom(32), os.urandom(16)
+
+
+def ctr(data, key: bytes, iv: bytes, offset: int) -> bytes:
+    # Encrypts or decrypts data that starts at offset in the file
+    counter = (int.from_bytes(iv, 'big') + offset // BLOCK_SIZE) % (1 << 128)
+
+    return tgcrypto.ctr256_encrypt(data, key,
+                                   bytearray(counter.to_bytes(BLOCK_SIZE, 'big')),
+                                   bytearray([offset % BLOCK_SIZE]))
+
+
+class FileCrypto:
+    def __init__(self, workers: int = None, bufSize: int = 64*1024*1024,
+                 io: IOExecutor = None):
+        self.executor = ThreadPoolExecutor(workers if workers else os.cpu_count())
+        self.bufSize = bufSize # how much of a file is read at a time
+        self.io = io if io else IOExecutor()
+
+
+    async def crypt(self, data, key: bytes, iv: bytes, offset: int) -> bytes:
+        # Same as ctr but runs in the thread pool, big buffers are
+        # split between threads
+        loop = asyncio.get_event_loop()
+        data = memoryview(data)
+
+        segments = [loop.run_in_executor(self.executor, ctr,
+                                         data[i:i+SEGMENT_SIZE], key, iv, offset+i)
+                    for i in range(0, len(data), SEGMENT_SIZE)]
+
+        return b''.join(await asyncio.gather(*segments))
+
+
+    async def _read(self, outFileName: str, f, size: int, priority: int) -> bytes:
+        return await self.io.run(outFileName, f.read, size, priority=priority)
+
+
+    async def _write(self, outFileName: str, f, data: bytes, priority: int):
+        await self.io.run(outFileName, f.write, data, priority=priority)
+
+
+    async def encryptFile(self, startIndex: int, filePath: str, outFileName: str,
+                          chunkSize: int, key: bytes, iv: bytes,
+                          priority: int = BACKGROUND, h = None) -> int:
+        # Works like splitFile but the chunk is encrypted while it's copied,
+        # the original data is added to the hash h if it's given.
+        # Returns the index of the next chunk or 0 if the file ended
+        fileSize = os.path.getsize(filePath)
+        end = min(startIndex + chunkSize, fileSize)
+
+        with open(filePath, 'rb') as in_fil, open(outFileName, 'wb') as out_fil:
+            in_fil.seek(startIndex)
+
+            for i in range(startIndex, end, self.bufSize):
+                data = await self._read(outFileName, in_fil,
+                                        min(self.bufSize, end - i), priority)
+                if h:
+                    h.update(data)
+                await self._write(outFileName, out_fil,
+                                  await self.crypt(data, key, iv, i), priority)
+
+        return end if end < fileSize else 0
+
+
+    async def decryptAppend(self, filePath: str, outFileName: str,
+                            offset: int, key: bytes, iv: bytes,
+                            priority: int = FOREGROUND):
+        # Works like concatFiles but decrypts filePath while appending it,
+        # offset is where filePath starts in the original file.
+        # The first chunk overwrites outFileName
+        with open(filePath, 'rb') as in_fil, \
+             open(outFileName, 'ab' if offset else 'wb') as out_fil:
+            while True:
+                data = await self._read(outFileName, in_fil, self.bufSize, priority)
+                if not data:
+                    break
+
+                await self._write(outFileName, out_fil,
+                                  await self.crypt(data, key, iv, offset), priority)
+                offset += len(data)
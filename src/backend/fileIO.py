@@ -1,5 +1,6 @@
 import configparser
 import pickle
+import zlib
 import os
 
 class FileIO:
@@ -15,15 +16,37 @@ class FileIO:
             self.cfg['telegram']['api_hash'] = ''
             self.cfg['telegram']['channel_id'] = 'me'
             self.cfg['telegram']['max_sessions'] = '4'
+            self.cfg['telegram']['accounts'] = '1'
+            self.cfg['telegram']['placement'] = 'round_robin'
+            self.cfg['telegram']['replicate_every'] = '0' # minutes, 0 disables it
+            self.cfg['telegram']['replicate_passphrase'] = ''
+            self.cfg['telegram']['snapshot_deltas'] = '50'
             self.cfg['paths'] = {}
             self.cfg['paths']['data_path'] = os.path.expanduser("~/tgFileManager")
             self.cfg['paths']['tmp_path'] = os.path.expanduser("~/.tmp/tgFileManager")
             self.cfg['paths']['download_full_path'] = False
+            self.cfg['transfer'] = {}
+            self.cfg['transfer']['read_ahead'] = '4'
+            self.cfg['transfer']['connections'] = '4'
+            self.cfg['transfer']['parts_in_flight'] = '1' # 8 is faster, see fileParts
+            self.cfg['transfer']['encrypt'] = 'False'
+            self.cfg['transfer']['crypto_workers'] = '0' # 0 uses all cores
+            self.cfg['transfer']['scrub_batch'] = '100'
+            self.cfg['transfer']['scrub_interval'] = '1'
+            self.cfg['transfer']['scrub_every'] = '0' # hours, 0 disables it
+            self.cfg['transfer']['orphan_age'] = '24' # hours before orphans are deleted
+            self.cfg['transfer']['small_file_size'] = str(10*1024*1024)
+            self.cfg['transfer']['group_concurrency'] = '4'
+            self.cfg['transfer']['io_workers'] = '2' # per disk
+            self.cfg['transfer']['io_queue'] = '4'
+            self.cfg['transfer']['chunk_size'] = '0' # MiB, 0 chooses it for every file
             self.cfg['keybinds'] = {}
             self.cfg['keybinds']['upload'] = 'u'
             self.cfg['keybinds']['download'] = 'd'
             self.cfg['keybinds']['resume'] = 'r'
             self.cfg['keybinds']['cancel'] = 'c'
+            self.cfg['keybinds']['sync'] = 's'
+            self.cfg['keybinds']['scrub'] = 'v'
             self.cfg['telegram']['api_id'] = input("api_id: ")
             self.cfg['telegram']['api_hash'] = input("api_hash: ")
             with open(os.path.expanduser("~/.config/tgFileManager.ini"), 'w') as f:
@@ -74,6 +97,21 @@ class FileIO:
         os.remove(os.path.join(self.cfg['paths']['data_path'], "resume_{}".format(sFile)))
 
 
+    def saveBatchData(self, batchData: dict):
+        with open(os.path.join(self.cfg['paths']['data_path'], "batch"), 'wb') as f:
+            pickle.dump(batchData, f)
+
+
+    def loadBatchData(self) -> dict:
+        batchData = {}
+
+        if os.path.isfile(os.path.join(self.cfg['paths']['data_path'], "batch")):
+            with open(os.path.join(self.cfg['paths']['data_path'], "batch"), 'rb') as f:
+                batchData = pickle.load(f)
+
+        return batchData
+
+
     def loadIndexData(self, sFile: str) -> int:
         indexData = 1
 
@@ -87,3 +125,55 @@ class FileIO:
     def saveIndexData(self, sFile: str, index: int):
         with open(os.path.join(self.cfg['paths']['data_path'], "index_{}".format(sFile)), 'wb') as f:
             pickle.dump(index, f)
+
+
+    def loadLinkStats(self) -> dict:
+        linkStats = {}
+
+        if os.path.isfile(os.path.join(self.cfg['paths']['data_path'], "link")):
+            with open(os.path.join(self.cfg['paths']['data_path'], "link"), 'rb') as f:
+                linkStats = pickle.load(f)
+
+        return linkStats
+
+
+    def saveLinkStats(self, linkStats: dict):
+        with open(os.path.join(self.cfg['paths']['data_path'], "link"), 'wb') as f:
+            pickle.dump(linkStats, f)
+
+
+    def loadReplicaData(self) -> dict:
+        replicaData = {}
+
+        if os.path.isfile(os.path.join(self.cfg['paths']['data_path'], "replica")):
+            with open(os.path.join(self.cfg['paths']['data_path'], "replica"), 'rb') as f:
+                replicaData = pickle.load(f)
+
+        return replicaData
+
+
+    def saveReplicaData(self, replicaData: dict):
+        with open(os.path.join(self.cfg['paths']['data_path'], "replica"), 'wb') as f:
+            pickle.dump(replicaData, f)
+
+
+    def loadScanCache(self, localPath: str) -> dict:
+        # the cache of every synced directory is in its own file
+        scanCache = {}
+        cachePath = os.path.join(self.cfg['paths']['data_path'],
+            "scan_{:08x}".format(zlib.crc32(localPath.encode())))
+
+        if os.path.isfile(cachePath):
+            with open(cachePath, 'rb') as f:
+                cacheData = pickle.load(f)
+
+            if cacheData['localPath'] == localPath: # not a crc collision
+                scanCache = cacheData['scan']
+
+        return scanCache
+
+
+    def saveScanCache(self, localPath: str, scanCache: dict):
+        with open(os.path.join(self.cfg['paths']['data_path'],
+                  "scan_{:08x}".format(zlib.crc32(localPath.encode()))), 'wb') as f:
+            pickle.dump({'localPath': localPath, 'scan': scanCache}, f)
@@ -0,0 +1,219 @@
+'''
+Reads parts of documents stored on telegram with upload.GetFile requests
+
+message.download always fetches the whole document, this is used when
+only a byte range of it is needed.
+
+Telegram serves documents in parts, a request can't cross a 1 MiB boundary
+so every request here asks for one whole 1 MiB aligned part, the unneeded
+bytes at the edges of the range are cut after receiving them.
+
+download fetches a whole document with many part requests in flight at the
+same time spread over several connections to the document's DC, so a single
+big chunk doesn't have to wait for one sequential stream. It opens the
+extra connections like pyrogram does for its media sessions, with pyrogram
+internals that can change between versions, so it's only used when
+parts_in_flight is set above 1. The parts are written by the IOExecutor.
+'''
+
+from collections import deque
+import threading
+import asyncio
+
+from pyrogram import raw
+from pyrogram.errors import AuthBytesInvalid
+from pyrogram.file_id import FileId
+from pyrogram.session import Session, Auth
+
+from backend.ioExecutor import IOExecutor, FOREGROUND
+
+PART_SIZE = 1024*1024
+
+
+def partRange(start: int, end: int) -> range:
+    # the parts that hold the bytes from start to end (not included)
+    return range(start // PART_SIZE, (end - 1) // PART_SIZE + 1)
+
+
+def cutPart(data: bytes, part: int, start: int, end: int) -> bytes:
+    # the bytes of a received part that are inside the range
+    part_start = part*PART_SIZE
+    return data[max(start - part_start, 0) : end - part_start]
+
+
+def writePart(f, lock, part: int, data: bytes):
+    # runs in the IOExecutor, the lock keeps seek and write together
+    # when two threads write parts of the same file
+    with lock:
+        f.seek(part*PART_SIZE)
+        f.write(data)
+
+
+class FileParts:
+    def __init__(self, telegram, io: IOExecutor = None):
+        self.telegram = telegram # pyrogram Client, must be started
+        self.io = io if io else IOExecutor()
+
+
+    async def getSession(self, dc_id: int):
+        # Same as what pyrogram does in get_file, the media sessions are
+        # stored in the client so they get closed when the client stops
+        async with self.telegram.media_sessions_lock:
+            session = self.telegram.media_sessions.get(dc_id)
+            if session:
+                return session
+
+            test_mode = await self.telegram.storage.test_mode()
+
+            if dc_id != await self.telegram.storage.dc_id():
+                session = Session(self.telegram, dc_id,
+                                  await Auth(self.telegram, dc_id, test_mode).create(),
+                                  test_mode, is_media=True)
+                await session.start()
+
+                for _ in range(3):
+                    exported_auth = await self.telegram.send(
+                        raw.functions.auth.ExportAuthorization(dc_id=dc_id))
+
+                    try:
+                        await session.send(raw.functions.auth.ImportAuthorization(
+                            id=exported_auth.id, bytes=exported_auth.bytes))
+                    except AuthBytesInvalid:
+                        continue
+                    else:
+                        break
+                else:
+                    await session.stop()
+                    raise AuthBytesInvalid
+            else:
+                session = Session(self.telegram, dc_id,
+                                  await self.telegram.storage.auth_key(),
+                                  test_mode, is_media=True)
+                await session.start()
+
+            self.telegram.media_sessions[dc_id] = session
+            return session
+
+
+    async def getExtraSessions(self, dc_id: int, count: int) -> list:
+        # Opens count more connections to dc_id that use the same
+        # authorization as the media session, the caller has to stop them
+        session = await self.getSession(dc_id)
+        test_mode = await self.telegram.storage.test_mode()
+        extra = []
+
+        for _ in range(count):
+            extra.append(Session(self.telegram, dc_id, session.auth_key,
+                                 test_mode, is_media=True))
+
+        await asyncio.gather(*[i.start() for i in extra])
+        return extra
+
+
+    def getLocation(self, message):
+        # returns the dc of the document and its location
+        file_id = FileId.decode(message.document.file_id)
+
+        return file_id.dc_id, raw.types.InputDocumentFileLocation(
+            id=file_id.media_id,
+            access_hash=file_id.access_hash,
+            file_reference=file_id.file_reference,
+            thumb_size=''
+        )
+
+
+    async def getPart(self, session, location, part: int) -> bytes:
+        r = await session.send(
+            raw.functions.upload.GetFile(location=location,
+                                         offset=part*PART_SIZE,
+                                         limit=PART_SIZE),
+            sleep_threshold=30
+        )
+
+        if not isinstance(r, raw.types.upload.File):
+            raise TypeError("Documents served by CDNs are not supported.")
+
+        return r.bytes
+
+
+    async def download(self, message, filePath: str, connections: int,
+                       inFlight: int, progress: callable = None,
+                       progress_args: tuple = (), should_stop: callable = None):
+        # Downloads the whole document to filePath with inFlight part
+        # requests at a time spread over connections connections.
+        # Parts are written at their offset as soon as they arrive, so at
+        # most inFlight parts are in memory.
+        # should_stop is checked before every request, returns False if it
+        # stopped the download
+        dc_id, location = self.getLocation(message)
+        size = message.document.file_size
+
+        sessions = [await self.getSession(dc_id)]
+        extra = await self.getExtraSessions(dc_id, connections - 1) if connections > 1 else []
+        sessions.extend(extra)
+
+        parts = deque(partRange(0, size))
+        current = [0]
+        lock = threading.Lock()
+
+        async def part_worker(session):
+            while parts:
+                if should_stop and should_stop():
+                    return
+
+                part = parts.popleft()
+                data = await self.getPart(session, location, part)
+                await self.io.run(filePath, writePart, f, lock, part, data,
+                                  priority=FOREGROUND)
+
+                current[0] += len(data)
+                if progress:
+                    progress(current[0], size, *progress_args)
+
+        workers = [asyncio.ensure_future(part_worker(sessions[i % len(sessions)]))
+                   for i in range(max(inFlight, 1))]
+
+        try:
+            with open(filePath, 'wb') as f:
+                await asyncio.gather(*workers)
+        finally:
+            # if a request failed the other workers are stopped too
+            for i in workers:
+                i.cancel()
+            for i in extra:
+                await i.stop()
+
+        return current[0] == size
+
+
+    async def iterRange(self, message, start: int, end: int, readAhead: int = 1):
+        # yields the bytes of the document from start to end (not included)
+        # in order, one part at a time.
+        # Up to readAhead parts are requested at the same time, so at most
+        # readAhead parts are kept in memory
+        dc_id, location = self.getLocation(message)
+        session = await self.getSession(dc_id)
+
+        parts = iter(partRange(start, end))
+        pending = deque()
+
+        def request_next():
+            part = next(parts, None)
+            if part is not None:
+                pending.append((part, asyncio.ensure_future(
+                    self.getPart(session, location, part))))
+
+        for _ in range(max(readAhead, 1)):
+            request_next()
+
+        try:
+            while pending:
+                part, task = pending.popleft()
+                data = await task
+                request_next()
+
+                yield cutPart(data, part, start, end)
+        finally:
+            # the reader stopped early
+            for _, task in pending:
+                task.cancel()
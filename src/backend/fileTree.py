@@ -0,0 +1,98 @@
+'''
+In-memory directory tree built from the rPath of every database entry
+
+Every directory keeps the total size and the number of files of its subtree,
+these are updated incrementally when a file is added, removed or renamed
+so showing them never requires walking the whole database.
+
+The file entries are not copied, the tree only keeps references to the
+dictionaries that are stored in fileDatabase.
+'''
+
+class DirNode:
+    def __init__(self, name: str = '', parent = None):
+        self.name = name
+        self.parent = parent
+        self.dirs = {} # name -> DirNode
+        self.files = [] # entries of fileDatabase
+        self.size = 0 # total size of the subtree
+        self.count = 0 # number of files in the subtree
+
+
+    def path(self) -> list:
+        # list of path components from root to this directory
+        components = []
+        node = self
+        while node.parent:
+            components.append(node.name)
+            node = node.parent
+
+        return components[::-1]
+
+
+    def walk(self):
+        # yields every file entry in this subtree
+        for i in self.files:
+            yield i
+
+        for i in self.dirs.values():
+            yield from i.walk()
+
+
+class FileTree:
+    def __init__(self, fileDatabase: list = ()):
+        self.root = DirNode()
+
+        for i in fileDatabase:
+            self.add(i)
+
+
+    def find(self, rPath: list):
+        # Returns the directory found at rPath or None if it doesn't exist
+        node = self.root
+        for i in rPath:
+            node = node.dirs.get(i)
+            if not node:
+                return None
+
+        return node
+
+
+    def _update(self, node: DirNode, size: int, count: int):
+        # propagate size and file count changes up to the root
+        while node:
+            node.size += size
+            node.count += count
+            node = node.parent
+
+
+    def add(self, fileData: dict):
+        node = self.root
+        for i in fileData['rPath'][:-1]:
+            if not i in node.dirs:
+                node.dirs[i] = DirNode(i, node)
+            node = node.dirs[i]
+
+        node.files.append(fileData)
+        self._update(node, fileData['size'], 1)
+
+
+    def remove(self, fileData: dict):
+        node = self.find(fileData['rPath'][:-1])
+        if not node:
+            raise ValueError("{} is not in the tree.".format('/'.join(fileData['rPath'])))
+
+        node.files.remove(fileData)
+        self._update(node, -fileData['size'], -1)
+
+        # remove directories that don't contain anything anymore
+        while node.parent and not node.count:
+            del node.parent.dirs[node.name]
+            node = node.parent
+
+
+    def rename(self, fileData: dict, newName: list):
+        # fileData['rPath'] is changed here so the entry stays the same object
+        self.remove(fileData)
+        fileData['rPath'] = newName
+        self.add(fileData)
@@ -0,0 +1,54 @@
+'''
+Fingerprints of the chunks of uploaded files
+
+Every chunk of a file gets a blake2b hash of its contents (before
+encryption), they are stored in the 'fingerprints' list of the database
+entry so a modified file can be re-uploaded by sending only the chunks
+whose fingerprint changed.
+'''
+
+import hashlib
+
+FINGERPRINT_SIZE = 16
+READ_SIZE = 1024*1024
+
+
+def newHash():
+    return hashlib.blake2b(digest_size=FINGERPRINT_SIZE)
+
+
+def fingerprint(filePath: str, start: int, size: int) -> bytes:
+    # hash of size bytes of filePath starting at start, blocks the caller
+    # so it should be run in an executor
+    h = newHash()
+
+    with open(filePath, 'rb') as f:
+        f.seek(start)
+        while size > 0:
+            data = f.read(min(READ_SIZE, size))
+            if not data:
+                break
+            h.update(data)
+            size -= len(data)
+
+    return h.digest()
+
+
+def copyChunk(filePath: str, outPath: str, start: int, size: int) -> tuple:
+    # Copies size bytes of filePath starting at start to outPath and hashes
+    # them while they are copied, so a chunk is read once to be split and
+    # fingerprinted. Returns the fingerprint and how many bytes were copied
+    h = newHash()
+    copied = 0
+
+    with open(filePath, 'rb') as f, open(outPath, 'wb') as out:
+        f.seek(start)
+        while copied < size:
+            data = f.read(min(READ_SIZE, size - copied))
+            if not data:
+                break
+            h.update(data)
+            out.write(data)
+            copied += len(data)
+
+    return h.digest(), copied
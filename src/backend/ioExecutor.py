@@ -0,0 +1,145 @@
+'''
+Thread pools for the blocking disk work of all sessions
+
+Splitting and concatenating chunks of 2 GB on the default executor lets
+every session hit the disk at the same time, so they all slow down and
+the callbacks of the UI have to wait. IOExecutor runs the jobs of every
+device (st_dev of the directory a job writes to) in its own queue with
+io_workers threads, so a slow disk doesn't hold up the jobs of another one.
+
+FOREGROUND jobs (downloads the user is waiting for, removing files) are
+taken before BACKGROUND ones (uploads, hashing, syncing). At most io_queue
+background jobs of a device can be queued or running, after that the
+transfers that submit them wait, which slows down reading new chunks
+instead of piling them up in tmp_path.
+
+stats() has how many jobs every device ran and how long they waited in the
+queue.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import weakref
+import asyncio
+import time
+import os
+
+FOREGROUND = 0
+BACKGROUND = 1
+
+
+def _deviceOf(directory: str) -> int:
+    # st_dev of the closest existing directory, runs in a thread
+    while not os.path.isdir(directory) and os.path.dirname(directory) != directory:
+        directory = os.path.dirname(directory)
+
+    return os.stat(directory).st_dev
+
+
+class _Device:
+    def __init__(self, loop, workers: int, queueSize: int):
+        self.queue = asyncio.PriorityQueue()
+        self.slots = asyncio.Semaphore(queueSize) # for background jobs
+        self.pool = ThreadPoolExecutor(workers)
+        self.tasks = [loop.create_task(self.worker(loop)) for _ in range(workers)]
+
+        self.jobs = 0
+        self.running = 0
+        self.wait = 0.0 # seconds spent in the queue by all jobs
+        self.maxWait = 0.0
+        self.seq = 0 # jobs with the same priority run in order
+
+
+    async def worker(self, loop):
+        while True:
+            priority, _, queued, future, func = await self.queue.get()
+            wait = time.monotonic() - queued
+
+            self.jobs += 1
+            self.wait += wait
+            self.maxWait = max(self.maxWait, wait)
+
+            try:
+                if not future.cancelled(): # the caller stopped waiting
+                    self.running += 1
+                    try:
+                        result = await loop.run_in_executor(self.pool, func)
+                    except Exception as e:
+                        if not future.cancelled():
+                            future.set_exception(e)
+                    else:
+                        if not future.cancelled():
+                            future.set_result(result)
+                    finally:
+                        self.running -= 1
+            finally:
+                if priority == BACKGROUND:
+                    self.slots.release()
+
+
+class IOExecutor:
+    instances = weakref.WeakSet() # read by the profiler
+
+    def __init__(self, workers: int = 2, queueSize: int = 4):
+        self.workers = workers # threads per device
+        self.queueSize = queueSize
+        self.loop = None # set by the first job
+        self.devices = {}
+        self.dirDevices = {} # directory: device, stat is slow on some disks
+        IOExecutor.instances.add(self)
+
+
+    async def device(self, filePath) -> int:
+        # the device of the closest existing directory of filePath, the
+        # stat runs in the default executor because it can block on a
+        # sleeping disk or a network mount
+        directory = os.path.dirname(os.path.abspath(filePath))
+
+        if not directory in self.dirDevices:
+            self.dirDevices[directory] = await self.loop.run_in_executor(
+                None, _deviceOf, directory)
+
+        return self.dirDevices[directory]
+
+
+    async def run(self, filePath, func: callable, *args,
+                  priority: int = BACKGROUND, **kwargs):
+        # runs func(*args, **kwargs) in the threads of the device filePath
+        # is on and returns its result
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+
+        dev = await self.device(filePath)
+        if not dev in self.devices:
+            self.devices[dev] = _Device(self.loop, self.workers, self.queueSize)
+        device = self.devices[dev]
+
+        if priority == BACKGROUND:
+            await device.slots.acquire() # released by the worker
+
+        future = self.loop.create_future()
+        device.seq += 1
+        device.queue.put_nowait((priority, device.seq, time.monotonic(), future,
+                                 partial(func, *args, **kwargs)))
+
+        return await future
+
+
+    def stats(self) -> dict:
+        return {dev: {'jobs'    : i.jobs,
+                      'queued'  : i.queue.qsize(),
+                      'running' : i.running,
+                      'wait'    : i.wait,
+                      'maxWait' : i.maxWait}
+                for dev, i in self.devices.items()}
+
+
+    async def close(self):
+        # stops the workers of every device, called when the program exits
+        devices, self.devices = self.devices, {}
+
+        for i in devices.values():
+            for task in i.tasks:
+                task.cancel()
+            await asyncio.gather(*i.tasks, return_exceptions=True)
+            i.pool.shutdown(wait=False)
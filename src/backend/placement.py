@@ -0,0 +1,98 @@
+'''
+Chooses the channel every uploaded chunk is stored in
+
+channel_id in the config can be a comma separated list of channels, the
+chunks of the files are spread over them by one of these policies:
+round_robin  - every chunk goes to the next channel
+least_loaded - the channel that stores the least bytes, chunks that are
+               still uploading count with their expected size
+hash         - always the same channel for the same path and chunk
+
+The channel of every chunk is stored in the 'channels' list of the database
+entry, entries that don't have it are stored in the first channel.
+'''
+
+from zlib import crc32
+
+from backend.chunking import chunkSize
+
+
+def parseChannels(channel_ids: str) -> list:
+    channels = []
+
+    for i in channel_ids.split(','):
+        try:
+            channels.append(int(i))
+        except ValueError:
+            channels.append(i.strip())
+
+    return channels
+
+
+class Placement:
+    def __init__(self, channels: list, policy: str, fileDatabase: list = ()):
+        if not policy in ('round_robin', 'least_loaded', 'hash'):
+            raise ValueError("placement should be round_robin, least_loaded or hash.")
+
+        self.channels = channels
+        self.policy = policy
+        self.next = 0 # used by round_robin
+        self.load = {i: 0 for i in channels} # bytes stored in every channel
+
+        for i in fileDatabase:
+            self.add(i)
+
+
+    def chunkChannel(self, fileData: dict, chunk: int):
+        # the channel that the chunk of fileData is stored in
+        if 'channels' in fileData:
+            return fileData['channels'][chunk]
+
+        return self.channels[0]
+
+
+    def chunkSizes(self, fileData: dict):
+        # yields the channel and size of every chunk of fileData
+        size = chunkSize(fileData)
+
+        for i in range(len(fileData['fileID'])):
+            yield self.chunkChannel(fileData, i), min(size, fileData['size'] - i*size)
+
+
+    def add(self, fileData: dict):
+        for channel, size in self.chunkSizes(fileData):
+            self.addLoad(channel, size)
+
+
+    def remove(self, fileData: dict):
+        for channel, size in self.chunkSizes(fileData):
+            self.addLoad(channel, -size)
+
+
+    def addLoad(self, channel, size: int):
+        # channels that were removed from the config aren't tracked
+        if channel in self.load:
+            self.load[channel] += size
+
+
+    def pick(self, rPath: list, chunk: int, size: int = 0):
+        # Returns the channel the chunk should be uploaded to, size is
+        # reserved in its load until settle is called, so concurrent
+        # uploads don't all pick the same channel
+        if self.policy == 'round_robin':
+            channel = self.channels[self.next % len(self.channels)]
+            self.next += 1
+        elif self.policy == 'least_loaded':
+            channel = min(self.channels, key=lambda x: self.load[x])
+        else:
+            channel = self.channels[crc32("{}:{}".format('/'.join(rPath), chunk).encode())
+                                    % len(self.channels)]
+
+        self.addLoad(channel, size)
+        return channel
+
+
+    def settle(self, channel, reserved: int, size: int = 0):
+        # replaces the size reserved by pick with the size that was
+        # uploaded, 0 if the upload failed or was cancelled
+        self.addLoad(channel, size - reserved)
@@ -0,0 +1,225 @@
+'''
+Profiling mode, enabled with cli.py --profile
+
+All the sessions and the UI share one asyncio loop, so a callback that
+takes too long freezes everything. While profiling:
+* a task that sleeps for LAG_INTERVAL measures how late the loop wakes it up
+* every callback the loop runs is timed, the ones slower than
+  slow_callback are saved with the stack of coroutines that ran in them
+* the time of every callback is added to the coroutines of its task,
+  this is saved in the collapsed stack format (one "a;b;c microseconds"
+  line per stack) that flamegraph.pl and speedscope can read
+* the time jobs wait before a thread of an executor (or of IOExecutor's
+  queues) takes them is measured
+* tracemalloc snapshots are taken every snapshot_interval seconds
+
+stop() writes <prefix>.txt with the report and <prefix>.folded with the
+stacks. Nothing is changed when the profiler isn't started.
+'''
+
+from collections import defaultdict
+import asyncio
+import time
+import tracemalloc
+import os
+
+LAG_INTERVAL = 0.1
+
+
+def _percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def _coroStack(task) -> list:
+    # the coroutines the task is suspended in, outermost first
+    stack = []
+    coro = task.get_coro()
+
+    while coro is not None and len(stack) < 64:
+        code = getattr(coro, 'cr_code', None) or getattr(coro, 'ag_code', None)
+        if code is None: # a future or an object that isn't a coroutine
+            break
+
+        stack.append((code.co_filename, getattr(coro, '__qualname__', code.co_name)))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'ag_await', None)
+
+    return stack
+
+
+class Profiler:
+    def __init__(self, prefix: str, slow_callback: float = 0.05,
+                 snapshot_interval: float = 60, frames: int = 10):
+        self.prefix = prefix # of the report files
+        self.slow_callback = slow_callback # seconds
+        self.snapshot_interval = snapshot_interval
+        self.frames = frames # saved by tracemalloc for every allocation
+        self.srcPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        self.lag = []
+        self.slow = [] # (duration, callback, stack)
+        self.stacks = defaultdict(float) # folded stack: seconds
+        self.coroTime = defaultdict(float) # coroutine: seconds, inclusive
+        self.coroSteps = defaultdict(int)
+        self.executorWait = defaultdict(list) # executor: seconds
+        self.snapshots = []
+        self.tasks = []
+
+
+    def start(self):
+        self.loop = asyncio.get_event_loop()
+        self.startTime = time.monotonic()
+
+        self._handleRun = asyncio.events.Handle._run
+        self._runInExecutor = self.loop.run_in_executor
+        asyncio.events.Handle._run = self._wrapRun()
+        self.loop.run_in_executor = self._wrapRunInExecutor
+
+        tracemalloc.start(self.frames)
+        self._snapshot()
+
+        self.tasks = [self.loop.create_task(self._measureLag()),
+                      self.loop.create_task(self._takeSnapshots())]
+
+
+    def _wrapRun(self):
+        profiler = self
+        handleRun = self._handleRun
+
+        def _run(handle):
+            task = getattr(handle._callback, '__self__', None)
+            if task in profiler.tasks: # the profiler's own work isn't measured
+                return handleRun(handle)
+
+            start = time.perf_counter()
+            stack = _coroStack(task) if isinstance(task, asyncio.Task) else None
+
+            handleRun(handle)
+
+            profiler._addCallback(handle, stack, time.perf_counter() - start)
+
+        return _run
+
+
+    def _addCallback(self, handle, stack: list, duration: float):
+        if stack:
+            names = [name for _, name in stack]
+            self.stacks[';'.join(names)] += duration
+
+            for filePath, name in set(stack):
+                if filePath.startswith(self.srcPath): # only the code of this program
+                    self.coroTime[name] += duration
+                    self.coroSteps[name] += 1
+        else:
+            names = [getattr(handle._callback, '__qualname__', repr(handle._callback))]
+            self.stacks[names[0]] += duration
+
+        if duration >= self.slow_callback:
+            self.slow.append((duration, repr(handle), ' > '.join(names)))
+
+
+    def _wrapRunInExecutor(self, executor, func, *args):
+        submitted = time.monotonic()
+        waits = self.executorWait['default' if executor is None else
+                                  '{}@{:x}'.format(type(executor).__name__, id(executor))]
+
+        def timed():
+            waits.append(time.monotonic() - submitted)
+            return func(*args)
+
+        return self._runInExecutor(executor, timed)
+
+
+    async def _measureLag(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lag.append(time.monotonic() - before - LAG_INTERVAL)
+
+
+    def _snapshot(self):
+        # the memory used by tracemalloc itself isn't counted
+        self.snapshots.append(tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)))
+
+
+    async def _takeSnapshots(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            self._snapshot()
+
+
+    def stop(self):
+        # Restores the loop and writes the report. It's called after the
+        # loop stopped, so it runs the loop until the cancelled tasks end
+        for i in self.tasks:
+            i.cancel()
+        if not self.loop.is_running() and not self.loop.is_closed():
+            self.loop.run_until_complete(asyncio.gather(*self.tasks, return_exceptions=True))
+
+        asyncio.events.Handle._run = self._handleRun
+        del self.loop.run_in_executor # the method of the class is used again
+
+        self._snapshot()
+        tracemalloc.stop()
+
+        with open(self.prefix + '.folded', 'w') as f:
+            for stack, duration in sorted(self.stacks.items()):
+                if int(duration * 1e6):
+                    f.write("{} {}\n".format(stack, int(duration * 1e6)))
+
+        with open(self.prefix + '.txt', 'w') as f:
+            f.write(self.report())
+
+        return self.prefix + '.txt', self.prefix + '.folded'
+
+
+    def report(self) -> str:
+        from backend.ioExecutor import IOExecutor
+
+        lines = ["Profiled for {:.1f} s".format(time.monotonic() - self.startTime), '']
+
+        lines.append("Event loop lag (every {} s):".format(LAG_INTERVAL))
+        lines.append("  samples {}  mean {:.4f} s  p50 {:.4f} s  p99 {:.4f} s  max {:.4f} s".format(
+            len(self.lag), sum(self.lag) / len(self.lag) if self.lag else 0,
+            _percentile(self.lag, 0.5), _percentile(self.lag, 0.99),
+            max(self.lag, default=0)))
+        lines.append('')
+
+        lines.append("Callbacks slower than {} s ({}):".format(self.slow_callback, len(self.slow)))
+        for duration, handle, stack in sorted(self.slow, reverse=True)[:30]:
+            lines.append("  {:.4f} s  {}".format(duration, stack))
+            lines.append("            {}".format(handle[:200]))
+        lines.append('')
+
+        lines.append("Time on the loop per coroutine (including the ones it awaits):")
+        for name, duration in sorted(self.coroTime.items(), key=lambda x: -x[1])[:40]:
+            lines.append("  {:10.4f} s {:8} steps  {}".format(duration, self.coroSteps[name], name))
+        lines.append('')
+
+        lines.append("Executor queue wait:")
+        for executor, waits in self.executorWait.items():
+            lines.append("  {}  jobs {}  mean {:.4f} s  max {:.4f} s".format(
+                executor, len(waits), sum(waits) / len(waits) if waits else 0,
+                max(waits, default=0)))
+        for io in IOExecutor.instances:
+            for device, stats in io.stats().items():
+                lines.append("  IOExecutor device {}  jobs {}  mean {:.4f} s  max {:.4f} s".format(
+                    device, stats['jobs'], stats['wait'] / stats['jobs'] if stats['jobs'] else 0,
+                    stats['maxWait']))
+        lines.append('')
+
+        first, last = self.snapshots[0], self.snapshots[-1]
+        current = sum(i.size for i in last.statistics('filename'))
+        lines.append("Memory allocated by Python: {:.1f} MiB at exit, {} snapshots".format(
+            current / 1024 / 1024, len(self.snapshots)))
+        lines.append("Top allocations at exit:")
+        for i in last.statistics('lineno')[:20]:
+            lines.append("  {}".format(i))
+        lines.append("Biggest growth since start:")
+        for i in last.compare_to(first, 'lineno')[:20]:
+            lines.append("  {}".format(i))
+
+        return '\n'.join(lines) + '\n'
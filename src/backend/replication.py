@@ -0,0 +1,377 @@
+'''
+Replicates the file database into the first channel
+
+Without the database the uploaded chunks can't be found, so it's copied
+to the channel as documents:
+* a snapshot has every entry of the database
+* a delta has the entries that were added or changed and the paths that
+  were removed since the previous message
+* the head is a pinned text message with the IDs of the snapshot and of
+  the deltas after it, it's edited after every new message
+
+Another computer rebuilds the database by reading the head, the snapshot
+and the deltas in order, no history has to be scanned. A new snapshot
+replaces the old messages after snapshot_deltas deltas, or when the deltas
+are half as big as the snapshot.
+
+The messages are JSON compressed with zlib and, if replicate_passphrase is
+set, encrypted with a key derived from it and authenticated with an HMAC,
+so a changed message is rejected instead of restoring a wrong database.
+It has to be set when files are encrypted, because their keys are in the
+database. The entries are copied on the event loop and packed in an
+executor, packing can take a while with big databases.
+
+Only a 64 bit digest of the path and of the entry is kept for every file to
+know what changed, the entries themselves are read from the database. The
+path digest includes how many entries before it have the same rPath, so
+entries with duplicate paths are all kept.
+
+LocalBackend keeps the messages in a directory, so replication can be
+tried without telegram.
+'''
+
+from base64 import b64encode, b64decode
+import asyncio
+import hashlib
+import hmac
+import zlib
+import json
+import os
+
+from backend.catalog import CatalogEntry
+from backend.fileCrypto import ctr
+from backend.fingerprint import FINGERPRINT_SIZE
+
+MAGIC = b'TFMC3'
+HEAD_PREFIX = '{"catalog": 1,'
+KDF_ROUNDS = 200000
+MAC_SIZE = 32
+
+
+def _keys(passphrase: str, salt: bytes) -> tuple:
+    # the encryption key and the HMAC key
+    keys = hashlib.pbkdf2_hmac('sha256', passphrase.encode(), salt, KDF_ROUNDS, 64)
+    return keys[:32], keys[32:]
+
+
+def pack(obj, passphrase: str = '') -> bytes:
+    data = zlib.compress(json.dumps(obj, separators=(',', ':')).encode())
+
+    if not passphrase:
+        return MAGIC + b'P' + data
+
+    salt, iv = os.urandom(16), os.urandom(16)
+    key, macKey = _keys(passphrase, salt)
+    data = MAGIC + b'E' + salt + iv + ctr(data, key, iv, 0)
+    return data + hmac.new(macKey, data, 'sha256').digest()
+
+
+def unpack(data: bytes, passphrase: str = ''):
+    if not data.startswith(MAGIC):
+        if data.startswith(MAGIC[:4]):
+            raise ValueError("The replicated database has an older format, replicate it again.")
+        raise ValueError("Not a replicated database.")
+
+    mode, body = data[len(MAGIC):len(MAGIC)+1], data[len(MAGIC)+1:]
+    if mode == b'E':
+        if not passphrase:
+            raise ValueError("The replicated database is encrypted, set replicate_passphrase.")
+
+        key, macKey = _keys(passphrase, body[:16])
+        if not hmac.compare_digest(hmac.new(macKey, data[:-MAC_SIZE], 'sha256').digest(),
+                                   data[-MAC_SIZE:]):
+            raise ValueError("The replicated database was changed or "
+                             "replicate_passphrase is wrong.")
+
+        data = ctr(body[32:-MAC_SIZE], key, body[16:32], 0)
+    else:
+        data = body
+
+    try:
+        return json.loads(zlib.decompress(data))
+    except (zlib.error, ValueError):
+        raise ValueError("Can't read the replicated database, wrong replicate_passphrase?")
+
+
+def entryRecord(fileData) -> dict:
+    # the entry as JSON types, bytes are base64 encoded
+    record = {'rPath'  : list(fileData['rPath']),
+              'fileID' : list(fileData['fileID']),
+              'size'   : fileData['size']}
+
+    for i in ('key', 'iv'):
+        if i in fileData:
+            record[i] = b64encode(fileData[i]).decode()
+    if 'fingerprints' in fileData:
+        record['fingerprints'] = b64encode(b''.join(fileData['fingerprints'])).decode()
+    if 'channels' in fileData:
+        record['channels'] = list(fileData['channels'])
+    if 'chunkSize' in fileData:
+        record['chunkSize'] = fileData['chunkSize']
+
+    return record
+
+
+def recordEntry(record: dict) -> CatalogEntry:
+    for i in ('key', 'iv'):
+        if i in record:
+            record[i] = b64decode(record[i])
+    if 'fingerprints' in record:
+        fingerprints = b64decode(record['fingerprints'])
+        record['fingerprints'] = [fingerprints[i:i+FINGERPRINT_SIZE]
+                                  for i in range(0, len(fingerprints), FINGERPRINT_SIZE)]
+
+    return CatalogEntry(record)
+
+
+def _digest(data: str) -> int:
+    return int.from_bytes(hashlib.blake2b(data.encode(), digest_size=8).digest(), 'big')
+
+
+def pathKeys(records: list) -> list:
+    # The path key of every record, a digest of its rPath and of how many
+    # records before it have the same one. The rPath is JSON encoded so
+    # components that contain '/' don't collide with other paths
+    seen = {}
+    keys = []
+
+    for record in records:
+        rPath = tuple(record['rPath'])
+        seen[rPath] = seen.get(rPath, -1) + 1
+        keys.append(_digest(json.dumps([record['rPath'], seen[rPath]])))
+
+    return keys
+
+
+def recordKey(record: dict) -> int:
+    return _digest(json.dumps(record, sort_keys=True))
+
+
+class LocalBackend:
+    # Stores the messages as files in dirPath, the head is the file "head"
+    def __init__(self, dirPath: str):
+        self.dirPath = dirPath
+        if not os.path.isdir(dirPath):
+            os.makedirs(dirPath)
+
+
+    async def send(self, name: str, data: bytes) -> int:
+        IDs = [int(i) for i in os.listdir(self.dirPath) if i.isdigit()]
+        ID = max(IDs, default=0) + 1
+
+        with open(os.path.join(self.dirPath, str(ID)), 'wb') as f:
+            f.write(data)
+
+        return ID
+
+
+    async def read(self, ID: int) -> bytes:
+        with open(os.path.join(self.dirPath, str(ID)), 'rb') as f:
+            return f.read()
+
+
+    async def delete(self, IDList: list):
+        for i in IDList:
+            if os.path.isfile(os.path.join(self.dirPath, str(i))):
+                os.remove(os.path.join(self.dirPath, str(i)))
+
+
+    async def getHead(self) -> str:
+        if not os.path.isfile(os.path.join(self.dirPath, "head")):
+            return None
+
+        with open(os.path.join(self.dirPath, "head")) as f:
+            return f.read()
+
+
+    async def setHead(self, text: str):
+        with open(os.path.join(self.dirPath, "head"), 'w') as f:
+            f.write(text)
+
+
+class TelegramBackend:
+    # Stores the messages in channel with the session of tHandler,
+    # the session has to be started
+    def __init__(self, tHandler, channel):
+        self.tHandler = tHandler
+        self.channel = channel
+
+
+    async def send(self, name: str, data: bytes) -> int:
+        return await self.tHandler.sendBytes(self.channel, name, data)
+
+
+    async def read(self, ID: int) -> bytes:
+        return await self.tHandler.readBytes(self.channel, ID)
+
+
+    async def delete(self, IDList: list):
+        await self.tHandler.deleteUseless({self.channel: IDList}, 2)
+
+
+    async def getHead(self) -> str:
+        return await self.tHandler.getPinned(self.channel)
+
+
+    async def setHead(self, text: str):
+        await self.tHandler.setPinned(self.channel, text, HEAD_PREFIX)
+
+
+class Replicator:
+    def __init__(self, state: dict = None, save: callable = None,
+                 passphrase: str = '', snapshotDeltas: int = 50):
+        # state is what was replicated last time, save is called with it
+        # after every message
+        if not state:
+            state = {'seq': 0, 'snapshot': None, 'deltas': []}
+        if state.get('format') != MAGIC:
+            # a new replica, or one of an older format that is replaced
+            # by a snapshot the next time
+            state = {'seq': state['seq'], 'snapshot': None,
+                     'deltas': [], 'snapshotBytes': 0,
+                     'deltaBytes': 0, 'digests': {}, # path key: record key
+                     'format': MAGIC, 'old': self._oldIDs(state)}
+        self.state = state
+        self.save = save
+        self.passphrase = passphrase
+        self.snapshotDeltas = snapshotDeltas
+
+
+    @staticmethod
+    def _oldIDs(state: dict) -> list:
+        # the messages of a replica of an older format, deleted with the
+        # messages the next snapshot replaces
+        return state.get('old', []) + \
+               ([state['snapshot']] if state['snapshot'] else []) + state['deltas']
+
+
+    def messageIDs(self) -> list:
+        # the documents that are part of the replica
+        return self.state.get('old', []) + \
+               ([self.state['snapshot']] if self.state['snapshot'] else []) + \
+               self.state['deltas']
+
+
+    def _head(self) -> str:
+        return json.dumps({'catalog'  : 1,
+                           'seq'      : self.state['seq'],
+                           'snapshot' : self.state['snapshot'],
+                           'deltas'   : self.state['deltas']})
+
+
+    def _snapshotDue(self) -> bool:
+        return not self.state['snapshot'] or \
+               len(self.state['deltas']) >= self.snapshotDeltas or \
+               self.state['deltaBytes'] * 2 >= self.state['snapshotBytes']
+
+
+    def _pack(self, records: list):
+        # Runs in an executor with the records of the database, returns the
+        # kind of message, its data and the new digests, or None if nothing
+        # changed
+        old = self.state['digests']
+        digests = {}
+        changed = []
+        changedKeys = []
+
+        for path, record in zip(pathKeys(records), records):
+            key = recordKey(record)
+            digests[path] = key
+
+            if old.get(path) != key:
+                changed.append(record)
+                changedKeys.append(path)
+
+        removed = [i for i in old if not i in digests]
+
+        if self.state['snapshot'] and not changed and not removed:
+            return None
+
+        if self._snapshotDue():
+            return 'snapshot', pack({'entries': records}, self.passphrase), digests
+
+        return 'delta', pack({'set': changed, 'keys': changedKeys, 'remove': removed},
+                             self.passphrase), digests
+
+
+    async def replicate(self, backend, fileDatabase: list) -> str:
+        # Sends the changes of fileDatabase since the last call.
+        # Returns 'snapshot', 'delta' or 'unchanged'
+        if not self.passphrase and any('key' in i for i in fileDatabase):
+            raise ValueError("Set replicate_passphrase, the database has encryption keys.")
+
+        # the records are made here, the entries can change while the
+        # executor packs them
+        records = [entryRecord(i) for i in fileDatabase]
+        packed = await asyncio.get_event_loop().run_in_executor(None, self._pack, records)
+        if not packed:
+            return 'unchanged'
+
+        kind, data, digests = packed
+        self.state['seq'] += 1
+        ID = await backend.send("catalog_{}_{}".format(kind, self.state['seq']), data)
+
+        if kind == 'snapshot':
+            superseded = self.messageIDs()
+            self.state.update(snapshot=ID, deltas=[], snapshotBytes=len(data),
+                              deltaBytes=0, digests=digests, old=[])
+        else:
+            self.state['deltas'].append(ID)
+            self.state['deltaBytes'] += len(data)
+            self.state['digests'] = digests
+
+        await backend.setHead(self._head())
+        self._save()
+
+        if kind == 'snapshot' and superseded:
+            await backend.delete(superseded)
+
+        return kind
+
+
+    def _unpack(self, snapshot: bytes, deltas: list) -> tuple:
+        # Runs in an executor, returns the entries and their digests
+        entries = unpack(snapshot, self.passphrase)['entries']
+        records = dict(zip(pathKeys(entries), entries))
+
+        for data in deltas:
+            delta = unpack(data, self.passphrase)
+
+            for path in delta['remove']:
+                records.pop(path, None)
+            records.update(zip(delta['keys'], delta['set']))
+
+        digests = {path: recordKey(record) for path, record in records.items()}
+        return [recordEntry(i) for i in records.values()], digests
+
+
+    async def restore(self, backend) -> list:
+        # Rebuilds the database from the head, the replica continues
+        # from it. Returns the entries
+        head = await backend.getHead()
+        if not head or not head.startswith(HEAD_PREFIX):
+            raise ValueError("There is no replicated database in the channel.")
+        head = json.loads(head)
+
+        snapshot = await backend.read(head['snapshot'])
+        deltas = [await backend.read(ID) for ID in head['deltas']]
+
+        entries, digests = await asyncio.get_event_loop().run_in_executor(
+            None, self._unpack, snapshot, deltas)
+
+        self.state = {'seq'           : head['seq'],
+                      'snapshot'      : head['snapshot'],
+                      'deltas'        : head['deltas'],
+                      'snapshotBytes' : len(snapshot),
+                      'deltaBytes'    : sum(len(i) for i in deltas),
+                      'digests'       : digests,
+                      'format'        : MAGIC,
+                      'old'           : []}
+        self._save()
+
+        return entries
+
+
+    def _save(self):
+        if self.save:
+            self.save(self.state)
@@ -3,10 +3,25 @@ Extends transferHandler by managing the database and adding support for multiple
 '''
 
 from operator import itemgetter
+from collections import deque
+import logging
 import asyncio
+import time
+import os
 
-from backend.transferHandler import TransferHandler
+from backend.transferHandler import TransferHandler, transferErrors
 from backend.fileIO import FileIO
+from backend.fileTree import FileTree
+from backend.catalog import CatalogEntry
+from backend.dirScan import scanDirectory, changedFiles
+from backend.fingerprint import fingerprint
+from backend.fileCrypto import FileCrypto
+from backend.ioExecutor import IOExecutor
+from backend.placement import Placement, parseChannels
+from backend.chunking import ChunkSizer, chunkSize, MIN_CHUNK_SIZE
+from backend.replication import Replicator, TelegramBackend
+
+log = logging.getLogger(__name__)
 
 class SessionsHandler:
     def __init__(self, local_library: bool = True):
@@ -15,8 +30,39 @@ class SessionsHandler:
         self.tHandler = {}
         self.freeSessions = []
         self.transferInfo = {}
-        self.fileDatabase = self.fileIO.loadDatabase()
+        # databases saved before CatalogEntry have dictionaries
+        self.fileDatabase = [i if isinstance(i, CatalogEntry) else CatalogEntry(i)
+                             for i in self.fileIO.loadDatabase()]
+        self.fileTree = FileTree(self.fileDatabase)
         self.resumeData = self.fileIO.loadResumeData()
+        self.batchData = self.fileIO.loadBatchData() # unfinished directory downloads
+        self.runningBatches = {} # batchName -> the set of its pending files
+        self.initErrors = {} # sFile -> exception of the sessions that didn't connect
+
+        # the threads that split, concatenate and hash files are shared by
+        # all sessions
+        self.io = IOExecutor(self.fileIO.cfg.getint('transfer', 'io_workers', fallback=2),
+                             self.fileIO.cfg.getint('transfer', 'io_queue', fallback=4))
+        # and so are the encryption threads
+        self.crypto = FileCrypto(self.fileIO.cfg.getint('transfer', 'crypto_workers', fallback=0),
+                                 io=self.io)
+        # so is the channel every chunk gets uploaded to
+        self.placement = Placement(
+            parseChannels(self.fileIO.cfg['telegram']['channel_id']),
+            self.fileIO.cfg.get('telegram', 'placement', fallback='round_robin'),
+            self.fileDatabase)
+        # and the measurements that the chunk size of new files is chosen by
+        self.chunker = ChunkSizer(
+            self.fileIO.cfg.getint('transfer', 'chunk_size', fallback=0)*1024*1024,
+            self.fileIO.loadLinkStats(), self.fileIO.saveLinkStats)
+        # the copy of the database in the first channel
+        self.replicator = Replicator(
+            self.fileIO.loadReplicaData(), self.fileIO.saveReplicaData,
+            self.fileIO.cfg.get('telegram', 'replicate_passphrase', fallback=''),
+            self.fileIO.cfg.getint('telegram', 'snapshot_deltas', fallback=50))
+        # sessions are spread over accounts, session i logs in to account
+        # (i-1) % accounts + 1
+        self.accounts = self.fileIO.cfg.getint('telegram', 'accounts', fallback=1)
 
         for i in range(1, int(self.fileIO.cfg['telegram']['max_sessions'])+1):
             # set session as free only if there is no resume info for it
@@ -32,14 +78,50 @@ class SessionsHandler:
             # initialize all sessions that will be used
             self.tHandler[str(i)] = TransferHandler(
                 self.fileIO.cfg, str(i), self._saveProgress,
-                self._saveResumeData, local_library)
+                self._saveResumeData, local_library, self.crypto,
+                self.placement, self.io, self.chunker)
 
-        self.chunkSize = self.tHandler['1'].chunk_size
 
+    async def initSessions(self) -> dict:
+        # Sessions that have to log in ask for input, so they log in one at
+        # a time while all the others connect concurrently.
+        # Returns the sessions that failed to connect with their errors,
+        # they are also kept in initErrors
+        async def logins():
+            for i in needLogin:
+                await i.initSession()
 
-    async def initSessions(self):
-        for i in range(1, int(self.fileIO.cfg['telegram']['max_sessions'])+1):
-            await self.tHandler[str(i)].initSession()
+        needLogin = [i for i in self.tHandler.values() if i.needsLogin()]
+        sessions = [i for i in self.tHandler.values() if not i in needLogin]
+
+        results = await asyncio.gather(*[i.initSession() for i in sessions],
+                                       logins(), return_exceptions=True)
+
+        for i, result in zip(sessions, results):
+            if isinstance(result, Exception):
+                self.initErrors[i.s_file] = result
+
+        # a failed login stops the ones after it
+        if isinstance(results[-1], Exception):
+            for i in needLogin:
+                if not i.initialized:
+                    self.initErrors[i.s_file] = results[-1]
+
+        return self.initErrors
+
+
+    async def endSessions(self):
+        # Called when the program exits, saves the link measurements,
+        # disconnects the clients and stops the disk and encryption threads
+        self.chunker.flush()
+        await asyncio.gather(*[i.endSession() for i in self.tHandler.values()],
+                             return_exceptions=True)
+        await self.io.close()
+        self.crypto.executor.shutdown(wait=False)
+
+
+    def readySessions(self) -> int:
+        return len([i for i in self.tHandler.values() if i.initialized])
 
 
     def _useSession(self, sFile: str = None):
@@ -51,12 +133,25 @@ class SessionsHandler:
         if not self.freeSessions:
             raise IndexError("No free sessions.")
 
-        # get available session
-        retSession = self.freeSessions[0]
-        self.freeSessions.pop(0)
+        # get an available session of the account with the least
+        # transfers, so the load is spread over all accounts
+        busy = [0] * self.accounts
+        for i in self.tHandler:
+            if not i in self.freeSessions:
+                busy[(int(i)-1) % self.accounts] += 1
+
+        retSession = min(self.freeSessions, key=lambda x: busy[(int(x)-1) % self.accounts])
+        self.freeSessions.remove(retSession)
         return retSession
 
 
+    async def _waitSession(self):
+        # Waits until there is a free session, the caller should take it
+        # before awaiting anything else
+        while not self.freeSessions:
+            await asyncio.sleep(1)
+
+
     def _freeSession(self, sFile: str):
         if not int(sFile) in range(1, int(self.fileIO.cfg['telegram']['max_sessions'])+1):
             raise IndexError("sFile should be between 1 and {}.".format(int(self.fileIO.cfg['telegram']['max_sessions'])))
@@ -84,7 +179,9 @@ class SessionsHandler:
             if self.resumeData[sFile]['type'] == 'upload':
                 await self.upload(self.resumeData[sFile], sFile)
             elif self.resumeData[sFile]['type'] == 'download':
-                await self.download(self.resumeData[sFile], sFile)
+                fileData = self.resumeData[sFile]
+                if await self.download(fileData, sFile) and fileData.get('fullPath'):
+                    self._batchFileDone(fileData)
 
         elif selected == 2: # Ignore for now
             # as the session is removed both after the end of a cancelled transfer
@@ -93,7 +190,7 @@ class SessionsHandler:
 
         elif selected == 3: # delete the resume file
             if self.resumeData[sFile]['type'] == 'upload':
-                await self.cleanTg(self.resumeData[sFile]['fileID'])
+                await self.cleanTg([self.resumeData[sFile]])
 
             self._freeSession(sFile)
 
@@ -101,28 +198,83 @@ class SessionsHandler:
             self.fileIO.delResumeData(sFile)
 
 
-    async def cleanTg(self, IDList: list = []):
+    def _locations(self, fileList: list) -> dict:
+        # groups the message IDs of the files by the channel they are in
+        IDDict = {}
+        for fileData in fileList:
+            for i, ID in enumerate(fileData['fileID']):
+                IDDict.setdefault(self.placement.chunkChannel(fileData, i), []).append(ID)
+
+        return IDDict
+
+
+    async def cleanTg(self, fileList: list = None):
+        # Deletes the messages of the files in fileList, or every message
+        # that isn't in the database if fileList isn't given
         sFile = self._useSession()
         mode = 2
 
-        if not IDList:
+        if fileList is None:
             mode = 1
-            for i in self.fileDatabase:
-                for j in i['fileID']:
-                    IDList.append(j)
+            fileList = self.fileDatabase + [self._replicaData()]
 
-        await self.tHandler[sFile].deleteUseless(IDList, mode)
-        self._freeSession(sFile)
+        try:
+            await self.tHandler[sFile].initSession()
+            await self.tHandler[sFile].deleteUseless(self._locations(fileList), mode)
+        finally:
+            self._freeSession(sFile)
 
 
     async def deleteInDatabase(self, fileData: dict):
         self.fileDatabase.remove(fileData)
-        await self.cleanTg(fileData['fileID'])
-        self.fileIO.updateDatabase(self.fileDatabase)
+        self.fileTree.remove(fileData)
+        self.placement.remove(fileData)
+
+        try:
+            await self.cleanTg([fileData])
+        finally: # messages that weren't deleted are found by scrub
+            self.fileIO.updateDatabase(self.fileDatabase)
+
+
+    async def deleteManyInDatabase(self, fileList: list):
+        # Same as deleteInDatabase but the messages are deleted in one go
+        for i in fileList:
+            self.fileDatabase.remove(i)
+            self.fileTree.remove(i)
+            self.placement.remove(i)
+
+        try:
+            await self.cleanTg(fileList)
+        finally: # messages that weren't deleted are found by scrub
+            self.fileIO.updateDatabase(self.fileDatabase)
+
+
+    async def deleteTree(self, rPath: list):
+        # Deletes every file under the rPath directory in one go
+        node = self.fileTree.find(rPath)
+        if not node:
+            raise ValueError("There is no directory {}.".format('/'.join(rPath)))
+
+        await self.deleteManyInDatabase(list(node.walk()))
 
 
     def renameInDatabase(self, fileData: dict, newName: list):
-        self.fileDatabase[self.fileDatabase.index(fileData)]['rPath'] = newName
+        fileData = self.fileDatabase[self.fileDatabase.index(fileData)]
+        self.fileTree.rename(fileData, newName)
+
+        self.fileDatabase.sort(key=itemgetter('rPath'))
+        self.fileIO.updateDatabase(self.fileDatabase)
+
+
+    def _addToDatabase(self, *fileList: dict):
+        for fileData in fileList:
+            fileData = CatalogEntry(fileData)
+            self.fileDatabase.append(fileData)
+            self.fileTree.add(fileData)
+
+        # This could be slow, a faster alternative could be bisect.insort,
+        # howewer, I couldn't find a way to sort by an item in dictionary
+        self.fileDatabase.sort(key=itemgetter('rPath'))
         self.fileIO.updateDatabase(self.fileDatabase)
 
 
@@ -139,7 +291,13 @@ class SessionsHandler:
             fileData['chunkIndex'] = 0
             fileData['fileID'] = []
 
-        finalData = await self.tHandler[sFile].uploadFiles(fileData)
+        try:
+            # the session is connected here if it didn't finish warming up
+            await self.tHandler[sFile].initSession()
+            finalData = await self.tHandler[sFile].uploadFiles(fileData)
+        except BaseException:
+            self._failedTransfer(sFile)
+            raise
 
         self.transferInfo[sFile]['type'] = None # not transferring anything
 
@@ -149,18 +307,207 @@ class SessionsHandler:
                 self.resumeData[sFile] = {}
 
             self.fileIO.saveIndexData(sFile, finalData['index'])
-
-            # This could be slow, a faster alternative could be bisect.insort,
-            # howewer, I couldn't find a way to sort by an item in dictionary
-            self.fileDatabase.append(finalData['fileData'])
-            self.fileDatabase.sort(key=itemgetter('rPath'))
-
-            self.fileIO.updateDatabase(self.fileDatabase)
+            self._addToDatabase(finalData['fileData'])
             self._freeSession(sFile)
 
         else: # cancelled
             await self.resumeHandler(sFile, 2)
 
+        return finalData
+
+
+    def _failedTransfer(self, sFile: str):
+        # Called when a transfer raised, the session stays taken only if
+        # the transfer can be resumed
+        self.transferInfo[sFile]['type'] = None
+        self.tHandler[sFile].now_transmitting = 0
+        self.tHandler[sFile].should_stop = 0
+
+        if not self.resumeData[sFile]: # otherwise it's freed by resumeHandler
+            self._freeSession(sFile)
+
+
+    async def uploadDelta(self, fileData: dict, filePath: str):
+        # Re-uploads filePath as a new version of the uploaded file fileData,
+        # only the chunks whose fingerprint changed are sent and only the
+        # messages of the replaced chunks are deleted.
+        # The new version gets a new entry that replaces fileData when the
+        # upload finished
+        size = os.path.getsize(filePath)
+
+        if not 'fingerprints' in fileData or 'key' in fileData or \
+                chunkSize(fileData) < min(size, MIN_CHUNK_SIZE):
+            # There is nothing to compare old files with, and replacing
+            # chunks of encrypted files would reuse their keystream.
+            # Small files that grew past their chunk size are split again,
+            # with the old size they would get many small chunks
+            finalData = await self.upload({'rPath' : list(fileData['rPath']),
+                                           'path'  : filePath,
+                                           'size'  : size,
+                                           'type'  : 'upload'})
+            if finalData:
+                await self._waitSession()
+                try:
+                    await self.deleteInDatabase(fileData)
+                except transferErrors() as e:
+                    # the new version is saved, scrub finds the old messages
+                    log.warning("Deleting the old version of %s failed: %r",
+                                '/'.join(fileData['rPath']), e)
+
+            return finalData
+
+        sFile = self._useSession()
+
+        self.transferInfo[sFile]['rPath'] = fileData['rPath']
+        self.transferInfo[sFile]['progress'] = 0
+        self.transferInfo[sFile]['size'] = size
+        self.transferInfo[sFile]['type'] = 'upload'
+
+        # the new version keeps the chunk boundaries of the old one
+        fileChunkSize = chunkSize(fileData)
+        upData = {'rPath'     : fileData['rPath'],
+                  'path'      : filePath,
+                  'size'      : size,
+                  'index'     : self.fileIO.loadIndexData(sFile),
+                  'chunkSize' : fileChunkSize}
+
+        try:
+            fingerprints = []
+            for i in range(max(-(-size // fileChunkSize), 1)):
+                fingerprints.append(await self.io.run(
+                    filePath, fingerprint, filePath, i * fileChunkSize, fileChunkSize))
+
+            oldFingerprints = fileData['fingerprints']
+            changed = [i for i in range(len(fingerprints))
+                       if i >= len(oldFingerprints) or fingerprints[i] != oldFingerprints[i]]
+
+            await self.tHandler[sFile].initSession()
+            uploaded = await self.tHandler[sFile].uploadChunks(upData, changed)
+        finally:
+            self.transferInfo[sFile]['type'] = None
+            self.tHandler[sFile].now_transmitting = 0
+            self.fileIO.saveIndexData(sFile, upData['index'])
+            self._freeSession(sFile)
+
+        # deleted while uploading, its unchanged chunks were deleted with it
+        deleted = not any(fileData is i for i in self.fileDatabase)
+
+        if len(uploaded) < len(changed) or deleted: # the old version stays
+            if uploaded:
+                await self._waitSession()
+                await self.cleanTg([{'fileID'   : [i[0] for i in uploaded.values()],
+                                     'channels' : [i[1] for i in uploaded.values()]}])
+            return None
+
+        fileID = list(fileData['fileID'][:len(fingerprints)])
+        channels = [self.placement.chunkChannel(fileData, i) for i in range(len(fileID))]
+        superseded = {'fileID': [], 'channels': []}
+
+        for i in range(len(fingerprints), len(oldFingerprints)): # file got smaller
+            superseded['fileID'].append(fileData['fileID'][i])
+            superseded['channels'].append(self.placement.chunkChannel(fileData, i))
+
+        for i, (ID, channel) in uploaded.items():
+            if i < len(fileID):
+                superseded['fileID'].append(fileID[i])
+                superseded['channels'].append(channels[i])
+                fileID[i], channels[i] = ID, channel
+            else:
+                fileID.append(ID)
+                channels.append(channel)
+
+        newData = {i: fileData[i] for i in CatalogEntry.fields if i in fileData}
+        newData.update({'fileID'       : fileID,
+                        'channels'     : channels,
+                        'fingerprints' : fingerprints,
+                        'size'         : size})
+        newData = CatalogEntry(newData)
+
+        # the entry is swapped, readers of the old one never see a mix of
+        # both versions
+        index = next(i for i, j in enumerate(self.fileDatabase) if j is fileData)
+        self.fileDatabase[index] = newData
+        self.fileTree.remove(fileData)
+        self.fileTree.add(newData)
+        self.placement.remove(fileData)
+        self.placement.add(newData)
+        self.fileIO.updateDatabase(self.fileDatabase)
+
+        if superseded['fileID']:
+            await self._waitSession()
+            try:
+                await self.cleanTg([superseded])
+            except transferErrors() as e:
+                # the new version is saved, scrub finds the old messages
+                log.warning("Deleting the replaced chunks of %s failed: %r",
+                            '/'.join(fileData['rPath']), e)
+
+        return newData
+
+
+    async def uploadSmall(self, fileList: list) -> list:
+        # Uploads many files smaller than a chunk with one session,
+        # they are sent as media groups of 10 files.
+        # Returns the database entries of the files that were uploaded
+        sFile = self._useSession()
+
+        self.transferInfo[sFile]['rPath'] = ["{} files".format(len(fileList))]
+        self.transferInfo[sFile]['progress'] = 0
+        self.transferInfo[sFile]['size'] = sum(i['size'] for i in fileList)
+        self.transferInfo[sFile]['type'] = 'upload'
+
+        start = self.fileIO.loadIndexData(sFile)
+        # if it fails, groups sent before the error may use any of the names
+        index = start + len(fileList)
+        uploaded = []
+
+        try:
+            await self.tHandler[sFile].initSession()
+            index = await self.tHandler[sFile].uploadSmallFiles(fileList, start, uploaded)
+        finally:
+            # the groups that were sent before an error are still saved
+            self.fileIO.saveIndexData(sFile, index)
+            self.transferInfo[sFile]['type'] = None
+            self._freeSession(sFile)
+
+            if uploaded:
+                self._addToDatabase(*uploaded)
+
+        return uploaded
+
+
+    async def uploadStream(self, rPath: list, stream):
+        # Uploads everything read from stream until EOF as rPath,
+        # streams can't be resumed so a cancelled upload is deleted
+        sFile = self._useSession()
+
+        self.transferInfo[sFile]['rPath'] = rPath
+        self.transferInfo[sFile]['progress'] = 0
+        self.transferInfo[sFile]['size'] = 0 # unknown until EOF
+        self.transferInfo[sFile]['type'] = 'upload'
+
+        fileData = {'rPath'  : rPath,
+                    'index'  : self.fileIO.loadIndexData(sFile),
+                    'fileID' : [],
+                    'type'   : 'upload'}
+
+        try:
+            await self.tHandler[sFile].initSession()
+            # raises ValueError if the stream is empty
+            finalData = await self.tHandler[sFile].uploadStream(fileData, stream)
+        finally:
+            self.tHandler[sFile].should_stop = 0
+            self.transferInfo[sFile]['type'] = None
+            self.fileIO.saveIndexData(sFile, fileData['index'])
+            self._freeSession(sFile)
+
+        if finalData:
+            self._addToDatabase(finalData['fileData'])
+        elif fileData['fileID']:
+            await self.cleanTg([fileData])
+
+        return finalData
+
 
     async def download(self, fileData: dict, sFile: str = None):
         sFile = self._useSession(sFile) # Use a free session
@@ -173,7 +520,12 @@ class SessionsHandler:
         if not 'IDindex' in fileData:
             fileData['IDindex'] = 0
 
-        finalData = await self.tHandler[sFile].downloadFiles(fileData)
+        try:
+            await self.tHandler[sFile].initSession()
+            finalData = await self.tHandler[sFile].downloadFiles(fileData)
+        except BaseException:
+            self._failedTransfer(sFile)
+            raise
 
         self.transferInfo[sFile]['type'] = None
 
@@ -189,6 +541,482 @@ class SessionsHandler:
         return finalData
 
 
+    async def downloadRange(self, fileData: dict, start: int, end: int, dPath: str):
+        # Downloads bytes start to end of the file to a file named
+        # <name>_<start>-<end> in dPath
+        sFile = self._useSession()
+
+        self.transferInfo[sFile]['rPath'] = fileData['rPath']
+        self.transferInfo[sFile]['progress'] = 0
+        self.transferInfo[sFile]['size'] = end - start
+        self.transferInfo[sFile]['type'] = 'download'
+
+        try:
+            await self.tHandler[sFile].initSession()
+            return await self.tHandler[sFile].downloadRange(
+                fileData, start, end,
+                os.path.join(dPath if dPath else os.path.join(self.fileIO.cfg['paths']['data_path'], "downloads"),
+                             "{}_{}-{}".format(fileData['rPath'][-1], start, end))
+            )
+        finally:
+            # the session has to be freed even if the download failed
+            self.tHandler[sFile].should_stop = 0
+            self.transferInfo[sFile]['type'] = None
+            self._freeSession(sFile)
+
+
+    async def stream(self, fileData: dict, start: int = 0, end: int = None,
+                     readAhead: int = None):
+        # Async generator that yields the bytes of the file in order without
+        # writing them to disk, at most readAhead 1 MiB parts are in memory
+        if end is None:
+            end = fileData['size']
+        if not 0 <= start <= end <= fileData['size']:
+            raise IndexError("The range should be inside the file.")
+        if readAhead is None:
+            readAhead = self.fileIO.cfg.getint('transfer', 'read_ahead', fallback=4)
+
+        sFile = self._useSession()
+
+        self.transferInfo[sFile]['rPath'] = fileData['rPath']
+        self.transferInfo[sFile]['progress'] = 0
+        self.transferInfo[sFile]['size'] = end - start
+        self.transferInfo[sFile]['type'] = 'download'
+
+        try:
+            await self.tHandler[sFile].initSession()
+            async with self.tHandler[sFile].connected():
+                chunks = self.tHandler[sFile].iterRange(fileData, start, end, readAhead)
+                try:
+                    async for data in chunks:
+                        yield data
+                finally:
+                    await chunks.aclose()
+        finally:
+            # the session has to be freed even if the reader stops early
+            self.tHandler[sFile].should_stop = 0
+            self.transferInfo[sFile]['type'] = None
+            self._freeSession(sFile)
+
+
+    def findFile(self, rPath: list):
+        # Returns the database entry with the given rPath or None
+        node = self.fileTree.find(rPath[:-1])
+        if node:
+            for i in node.files:
+                if i['rPath'][-1] == rPath[-1]:
+                    return i
+
+        return None
+
+
+    async def downloadTree(self, rPath: list, dPath: str):
+        # Downloads every file under the rPath directory to dPath keeping
+        # their rPath layout. The files that haven't finished are saved as
+        # a batch, so the whole download can be resumed with resumeBatch
+        node = self.fileTree.find(rPath)
+        if not node:
+            raise ValueError("There is no directory {}.".format('/'.join(rPath)))
+
+        batchName = '/'.join(rPath)
+        self.batchData[batchName] = {'rPath'   : list(rPath),
+                                     'dPath'   : dPath,
+                                     'pending' : [list(i['rPath']) for i in node.walk()]}
+        self.fileIO.saveBatchData(self.batchData)
+
+        return await self.resumeBatch(batchName)
+
+
+    async def resumeBatch(self, batchName: str) -> bool:
+        # Downloads the pending files of a batch using every session.
+        # Files are ordered largest, smallest, second largest and so on so
+        # small files are downloaded while the big ones keep other sessions busy.
+        # Returns True if every file finished. The files that fail are
+        # skipped and stay pending, their errors are kept in the 'failed'
+        # field of the batch
+        batch = self.batchData[batchName]
+        pending = set(tuple(i) for i in batch['pending'])
+        self.runningBatches[batchName] = pending
+
+        files = [i for i in (self.findFile(j) for j in batch['pending']) if i]
+        pending.intersection_update(tuple(i['rPath']) for i in files) # deleted meanwhile
+
+        # files cancelled in the middle are finished by resumeHandler, they
+        # stay pending but aren't downloaded again in this run, resumeHandler
+        # removes them from pending with _batchFileDone
+        resuming = set(tuple(i['rPath']) for i in self.resumeData.values()
+                       if i and i['type'] == 'download')
+        files = [i for i in files if not tuple(i['rPath']) in resuming]
+        files.sort(key=itemgetter('size'))
+
+        queue = deque()
+        while files:
+            queue.append(files.pop())
+            if files:
+                queue.append(files.pop(0))
+
+        def save_batch():
+            batch['pending'] = [list(i) for i in pending]
+            self.fileIO.saveBatchData(self.batchData)
+
+        saved = [time.monotonic()]
+        batch['failed'] = {} # rPath -> error of the files that failed in this run
+
+        async def download_worker():
+            while queue:
+                fileData = queue.popleft()
+                await self._waitSession()
+
+                downloadData = self.downloadData(fileData, batch['dPath'])
+                downloadData['fullPath'] = True
+
+                try:
+                    finished = await self.download(downloadData)
+                except transferErrors() as e:
+                    log.warning("Downloading %s failed: %r", '/'.join(fileData['rPath']), e)
+                    batch['failed']['/'.join(fileData['rPath'])] = str(e)
+                    continue
+
+                if finished:
+                    pending.discard(tuple(fileData['rPath']))
+
+                    if time.monotonic() - saved[0] > 5: # not after every small file
+                        save_batch()
+                        saved[0] = time.monotonic()
+
+        try:
+            await asyncio.gather(*[download_worker() for _ in self.tHandler],
+                                 return_exceptions=True)
+        finally:
+            del self.runningBatches[batchName]
+
+            if not pending:
+                del self.batchData[batchName]
+            save_batch()
+
+        return not pending
+
+
+    def _batchFileDone(self, fileData: dict):
+        # A file of a batch was finished by resumeHandler, it's removed from
+        # the pending files of the batches it belongs to
+        rPath = tuple(fileData['rPath'])
+
+        for batchName, batch in list(self.batchData.items()):
+            if batch['dPath'] != fileData['dPath']:
+                continue
+
+            if batchName in self.runningBatches: # saved when the batch ends
+                self.runningBatches[batchName].discard(rPath)
+            elif list(rPath) in batch['pending']:
+                batch['pending'].remove(list(rPath))
+                if not batch['pending']:
+                    del self.batchData[batchName]
+
+        self.fileIO.saveBatchData(self.batchData)
+
+
+    async def syncDirectory(self, localPath: str, rPath: list,
+                            useInode: bool = False, prune: bool = False) -> dict:
+        # Uploads the files in localPath that are new or changed since the
+        # last sync to rPath/<path relative to localPath>, the entries of
+        # changed files are replaced.
+        # If prune is set, files under rPath that don't exist locally
+        # anymore are deleted from the database too
+        localPath = os.path.abspath(localPath)
+
+        cache = self.fileIO.loadScanCache(localPath)
+        scan = await self.io.run(localPath, scanDirectory, localPath)
+        changed = changedFiles(scan, cache, useInode)
+        result = {'scanned': len(scan), 'changed': len(changed),
+                  'uploaded': 0, 'failed': 0, 'pruned': 0}
+
+        # small files are uploaded in batches as media groups
+        smallSize = self.fileIO.cfg.getint('transfer', 'small_file_size', fallback=10*1024*1024)
+        small = [i for i in changed if scan[i][0] <= smallSize]
+        changed = [i for i in changed if scan[i][0] > smallSize]
+
+        async def upload_small_batch(relPaths):
+            fileList = []
+            for relPath in relPaths:
+                filePath = os.path.join(localPath, *relPath.split('/'))
+                if os.path.isfile(filePath):
+                    fileList.append({'rPath'   : rPath + relPath.split('/'),
+                                     'path'    : filePath,
+                                     'size'    : os.path.getsize(filePath),
+                                     'relPath' : relPath})
+                else: # deleted after the scan
+                    result['failed'] += 1
+
+            oldList = [i for i in (self.findFile(j['rPath']) for j in fileList) if i]
+
+            await self._waitSession()
+            try:
+                await self.uploadSmall(fileList)
+            except transferErrors() as e:
+                # the files that were sent before the error are kept
+                log.warning("Uploading %d small files failed: %r", len(fileList), e)
+
+            # the old versions of the files that were uploaded are replaced,
+            # uploadSmallFiles sets fileID of the files it sent
+            uploadedPaths = set(tuple(i['rPath']) for i in fileList if 'fileID' in i)
+            oldList = [i for i in oldList if tuple(i['rPath']) in uploadedPaths]
+            if oldList:
+                await self._waitSession()
+                try:
+                    await self.deleteManyInDatabase(oldList)
+                except transferErrors() as e:
+                    # the old entries are gone, scrub finds their messages
+                    log.warning("Deleting the old versions of %d files failed: %r",
+                                len(oldList), e)
+
+            for fileData in fileList:
+                if tuple(fileData['rPath']) in uploadedPaths:
+                    cache[fileData['relPath']] = scan[fileData['relPath']]
+                    result['uploaded'] += 1
+                else:
+                    result['failed'] += 1
+
+            self.fileIO.saveScanCache(localPath, cache)
+
+        async def upload_file(relPath):
+            fileRPath = rPath + relPath.split('/')
+            filePath = os.path.join(localPath, *relPath.split('/'))
+
+            await self._waitSession()
+
+            if not os.path.isfile(filePath): # deleted after the scan
+                return None
+
+            oldData = self.findFile(fileRPath)
+            if oldData:
+                # replaces the old entry and its messages
+                return await self.uploadDelta(oldData, filePath)
+
+            return await self.upload({
+                'rPath' : fileRPath,
+                'path'  : filePath,
+                'size'  : os.path.getsize(filePath),
+                'type'  : 'upload'
+            })
+
+        async def upload_worker():
+            while small:
+                batch = small[-100:]
+                del small[-100:]
+                await upload_small_batch(batch)
+
+            while changed:
+                relPath = changed.pop()
+
+                # one file that can't be uploaded doesn't stop the sync
+                try:
+                    finalData = await upload_file(relPath)
+                except transferErrors() as e:
+                    log.warning("Syncing %s failed: %r", relPath, e)
+                    finalData = None
+
+                if finalData:
+                    cache[relPath] = scan[relPath]
+                    result['uploaded'] += 1
+                    if not result['uploaded'] % 100:
+                        self.fileIO.saveScanCache(localPath, cache)
+                else:
+                    result['failed'] += 1
+
+        await asyncio.gather(*[upload_worker() for _ in self.tHandler])
+
+        if prune:
+            node = self.fileTree.find(rPath)
+            for i in list(node.walk()) if node else []:
+                if not '/'.join(i['rPath'][len(rPath):]) in scan:
+                    await self._waitSession()
+                    await self.deleteInDatabase(i)
+                    result['pruned'] += 1
+
+        # files that were deleted locally are forgotten
+        for relPath in [i for i in cache if not i in scan]:
+            del cache[relPath]
+
+        self.fileIO.saveScanCache(localPath, cache)
+        return result
+
+
+    async def scrub(self, repair: bool = False, orphans: bool = False,
+                    repairOrphans: bool = False) -> dict:
+        # Checks that the message of every chunk in the database still exists
+        # and has the expected size. Messages are requested scrub_batch at a
+        # time with scrub_interval seconds between requests, only when a
+        # session is free and the session is freed after every request, so
+        # foreground transfers can always take it.
+        # If orphans is set, media messages that aren't in the database are
+        # searched too (this scans the history of every channel).
+        # Everything is only reported unless repair is set, then entries with
+        # missing chunks are deleted. Entries with chunks of the wrong size
+        # are always only reported.
+        # Orphans are deleted only with repairOrphans, and only the ones older
+        # than orphan_age hours, another program or computer that uses the
+        # same channels could still be uploading the newer ones
+        batchSize = self.fileIO.cfg.getint('transfer', 'scrub_batch', fallback=100)
+        interval = self.fileIO.cfg.getfloat('transfer', 'scrub_interval', fallback=1)
+        orphanAge = self.fileIO.cfg.getfloat('transfer', 'orphan_age', fallback=24)*3600
+        result = {'checked': 0, 'missing': [], 'wrongSize': [], 'orphans': []}
+
+        # channel -> [(message ID, expected size, entry)]
+        expected = {}
+        for fileData in list(self.fileDatabase):
+            for ID, (channel, size) in zip(fileData['fileID'],
+                                           self.placement.chunkSizes(fileData)):
+                expected.setdefault(channel, []).append((ID, size, fileData))
+
+        dangling = {} # id of entry -> entry
+        for channel, chunks in expected.items():
+            for i in range(0, len(chunks), batchSize):
+                batch = chunks[i:i+batchSize]
+
+                await self._waitSession()
+                sFile = self._useSession()
+                try:
+                    await self.tHandler[sFile].initSession()
+                    messages = await self.tHandler[sFile].getMessages(
+                        channel, [ID for ID, _, _ in batch])
+                finally:
+                    self._freeSession(sFile)
+
+                for message, (ID, size, fileData) in zip(messages, batch):
+                    result['checked'] += 1
+
+                    if message.empty or not message.document:
+                        result['missing'].append(fileData['rPath'])
+                        dangling[id(fileData)] = fileData
+                    elif message.document.file_size != size:
+                        result['wrongSize'].append(fileData['rPath'])
+
+                await asyncio.sleep(interval)
+
+        oldOrphans = [] # the orphans that repairOrphans deletes
+        if orphans:
+            for channel in self.placement.channels:
+                # the history is read a page at a time like the batches
+                # above, the session is freed between pages
+                mediaIDs = []
+                offsetID = None
+                while offsetID != 0:
+                    await self._waitSession()
+                    sFile = self._useSession()
+                    try:
+                        await self.tHandler[sFile].initSession()
+                        IDList, offsetID = await self.tHandler[sFile].mediaIDs(
+                            channel, batchSize, offsetID or 0)
+                    finally:
+                        self._freeSession(sFile)
+
+                    mediaIDs.extend(IDList)
+                    await asyncio.sleep(interval)
+
+                # resume data is read after the scan so chunks uploaded
+                # during it are not orphans
+                knownIDs = set(ID for ID, _, _ in expected.get(channel, ()))
+                for fileData in list(self.fileDatabase) + [self._replicaData()] + \
+                        [i for i in self.resumeData.values() if i]:
+                    for j, ID in enumerate(fileData['fileID']):
+                        if self.placement.chunkChannel(fileData, j) == channel:
+                            knownIDs.add(ID)
+
+                for ID, date in mediaIDs:
+                    if not ID in knownIDs:
+                        result['orphans'].append((channel, ID))
+                        if time.time() - date >= orphanAge:
+                            oldOrphans.append((channel, ID))
+
+        if repair:
+            for fileData in dangling.values():
+                if any(fileData is i for i in self.fileDatabase): # not deleted meanwhile
+                    await self._waitSession()
+                    await self.deleteInDatabase(fileData)
+
+        if repairOrphans and oldOrphans:
+            await self._waitSession()
+            await self.cleanTg([{'fileID'   : [i[1] for i in oldOrphans],
+                                 'channels' : [i[0] for i in oldOrphans]}])
+
+        return result
+
+
+    def _replicaData(self) -> dict:
+        # the messages of the replicated database, so they aren't
+        # mistaken for orphans
+        IDList = self.replicator.messageIDs()
+        return {'fileID'   : IDList,
+                'channels' : [self.placement.channels[0]] * len(IDList)}
+
+
+    async def replicateCatalog(self) -> str:
+        # Sends the changes of the database since the last time to the
+        # first channel, see replication.
+        # Returns 'snapshot', 'delta' or 'unchanged'
+        await self._waitSession()
+        sFile = self._useSession()
+
+        try:
+            await self.tHandler[sFile].initSession()
+            return await self.replicator.replicate(
+                TelegramBackend(self.tHandler[sFile], self.placement.channels[0]),
+                self.fileDatabase)
+        finally:
+            self._freeSession(sFile)
+
+
+    async def restoreCatalog(self, force: bool = False) -> int:
+        # Replaces the database with the one replicated in the first channel,
+        # the local one has to be empty unless force is set.
+        # Returns the number of files
+        if self.fileDatabase and not force:
+            raise ValueError("The database isn't empty.")
+
+        await self._waitSession()
+        sFile = self._useSession()
+
+        try:
+            await self.tHandler[sFile].initSession()
+            entries = await self.replicator.restore(
+                TelegramBackend(self.tHandler[sFile], self.placement.channels[0]))
+        finally:
+            self._freeSession(sFile)
+
+        for i in self.fileDatabase:
+            self.placement.remove(i)
+
+        self.fileDatabase = sorted(entries, key=itemgetter('rPath'))
+        self.fileTree = FileTree(self.fileDatabase)
+        for i in self.fileDatabase:
+            self.placement.add(i)
+
+        self.fileIO.updateDatabase(self.fileDatabase)
+        return len(self.fileDatabase)
+
+
+    def deleteBatch(self, batchName: str):
+        # forgets about a batch, the files that were downloaded stay
+        del self.batchData[batchName]
+        self.fileIO.saveBatchData(self.batchData)
+
+
+    def downloadData(self, fileData: dict, dPath: str) -> dict:
+        # Creates the fileData needed to download a database entry
+        downloadData = {'rPath'  : fileData['rPath'],
+                        'dPath'  : dPath,
+                        'fileID' : fileData['fileID'],
+                        'size'   : fileData['size'],
+                        'type'   : 'download'}
+
+        for i in self.tHandler['1'].entry_keys:
+            if i in fileData:
+                downloadData[i] = fileData[i]
+
+        return downloadData
+
+
     async def cancelTransfer(self, sFile: str):
         if not int(sFile) in range(1, int(self.fileIO.cfg['telegram']['max_sessions'])+1):
             raise IndexError("sFile should be between 1 and {}.".format(int(self.fileIO.cfg['telegram']['max_sessions'])))
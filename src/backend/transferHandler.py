@@ -13,41 +13,52 @@ Don't upload files that are in the same directory as data_path
 The path of the uploaded file should only have ASCII characters,
 because the string is transmitted to a C function
 
-Due to how files are downloaded, downloading 2 files with the same name
-(not path) at the same time will cause problems.
-
 Also when a file with same name as one of previous files has been downloaded
 then the original file will be replaced. (If the original has not been moved)
 '''
 
-from pyrogram import Client
 import asyncio
+import time
+from io import BytesIO
+from contextlib import asynccontextmanager
 from shutil import copyfile
-from os import path, makedirs
+from os import path, makedirs, symlink
 import sys
 from backend.asyncFiles import AsyncFiles
+from backend.fileCrypto import newKey, ctr
+from backend.placement import Placement, parseChannels
+from backend.fingerprint import fingerprint, newHash, copyChunk
+from backend.chunking import ChunkSizer, chunkSize
+from backend.ioExecutor import FOREGROUND
 import logging
 
 # Disable messages from pyrogram
 logging.getLogger('pyrogram').setLevel(logging.ERROR)
 
 
+def transferErrors() -> tuple:
+    # What transfers raise when telegram or the disk fail, used in except
+    # clauses. pyrogram is only imported when an exception is matched
+    from pyrogram.errors import RPCError
+
+    return (RPCError, OSError, asyncio.TimeoutError)
+
+
 class TransferHandler:
     def __init__(self,
                  config: dict,
                  s_file: str,
                  progress_fun: callable, # Pointer to progress function
                  data_fun: callable, # Called for multi chunk transfers
-                 local_library: bool = True): # Where to search for library
+                 local_library: bool = True, # Where to search for library
+                 crypto = None, # FileCrypto shared by all sessions
+                 placement = None, # Placement shared by all sessions
+                 io = None, # IOExecutor shared by all sessions
+                 chunker = None): # ChunkSizer shared by all sessions
 
         self.asyncFiles = AsyncFiles(
             "{}transferHandler_extern.{}".format('' if local_library else '../',
-            'dll' if sys.platform == 'win32' else 'so'))
-
-        try:
-            self.telegram_channel_id = int(config['telegram']['channel_id'])
-        except ValueError:
-            self.telegram_channel_id = config['telegram']['channel_id']
+            'dll' if sys.platform == 'win32' else 'so'), io)
 
         self.data_path = config['paths']['data_path']
         self.tmp_path = config['paths']['tmp_path']
@@ -55,63 +66,219 @@ class TransferHandler:
         self.progress_fun = progress_fun
         self.data_fun = data_fun
         self.download_full_path = config['paths']['download_full_path']
+        self.read_ahead = config.getint('transfer', 'read_ahead', fallback=4)
+        # used to download the parts of one chunk at the same time
+        self.connections = config.getint('transfer', 'connections', fallback=4)
+        self.parts_in_flight = config.getint('transfer', 'parts_in_flight', fallback=1)
+        # small files are sent 10 at a time in media groups
+        self.group_concurrency = config.getint('transfer', 'group_concurrency', fallback=4)
+        self.crypto = crypto
+        self.encrypt = config.getboolean('transfer', 'encrypt', fallback=False)
+        # stored in the database if present
+        self.entry_keys = ('key', 'iv', 'channels', 'fingerprints', 'chunkSize')
         self.now_transmitting = 0 # no, single chunk, multi chunk (0-2)
         self.should_stop = 0
 
-        self.mul_chunk_size = 2000*1024
-        self.chunk_size = self.mul_chunk_size * 1024
+        # every file has its own chunk size, see chunking
+        self.chunker = chunker if chunker else ChunkSizer()
+
+        self.placement = placement if placement else \
+            Placement(parseChannels(config['telegram']['channel_id']), 'round_robin')
+        # the channel files without channel information are stored in
+        self.telegram_channel_id = self.placement.channels[0]
+
+        # pyrogram is imported and the client is created on first use,
+        # importing it takes longer than drawing the UI
+        self.api_id = config['telegram']['api_id']
+        self.api_hash = config['telegram']['api_hash']
+        self._telegram = None
+        self._parts = None
+
+        self.initialized = False
+        self.init_lock = asyncio.Lock()
+
+
+    @property
+    def telegram(self):
+        if not self._telegram:
+            from pyrogram import Client
+
+            self._telegram = Client(path.join(self.data_path, "a{}".format(self.s_file)),
+                                    self.api_id, self.api_hash)
+
+        return self._telegram
+
 
-        self.telegram = Client(path.join(self.data_path, "a{}".format(s_file)),
-                               config['telegram']['api_id'], config['telegram']['api_hash'])
+    @property
+    def parts(self):
+        if not self._parts:
+            from backend.fileParts import FileParts
+
+            self._parts = FileParts(self.telegram, self.asyncFiles.io)
+
+        return self._parts
+
+
+    def needsLogin(self) -> bool:
+        # pyrogram asks for the phone number if the session file doesn't exist
+        return not path.isfile(path.join(self.data_path, "a{}.session".format(self.s_file)))
 
 
     async def initSession(self):
         # Connect to telegram servers when starting
         # So that if we are missing any sessions it will prompt for login
         # Before starting the UI
-        async with self.telegram:
-            pass
+        # Only the first call connects, the others wait for it to finish.
+        # The client stays connected until endSession, so transfers don't
+        # have to connect again
+        async with self.init_lock:
+            if not self.initialized:
+                await self.telegram.start()
+                self.initialized = True
+
+
+    @asynccontextmanager
+    async def connected(self):
+        # Used instead of async with self.telegram, connects the client
+        # if it isn't yet and leaves it connected
+        await self.initSession()
+        yield self.telegram
+
+
+    async def endSession(self):
+        # Disconnects the client, called when the program exits
+        async with self.init_lock:
+            if self.initialized:
+                await self.telegram.stop()
+                self.initialized = False
+
+
+    def _entry(self, fileData: dict) -> dict:
+        # The information about the file that is stored in the database
+        entry = {'rPath'  : fileData['rPath'],
+                 'fileID' : fileData['fileID'],
+                 'size'   : fileData['size']}
+
+        for i in self.entry_keys: # only stored by some files
+            if i in fileData:
+                entry[i] = fileData[i]
+
+        return entry
+
+
+    async def _measured(self, transfer):
+        # Awaits a chunk transfer and returns its result and how long it
+        # took, failures of the link are counted by the chunker
+        started = time.monotonic()
+
+        try:
+            result = await transfer
+        except Exception as e:
+            # disk errors and bugs don't make chunks smaller, pyrogram was
+            # already imported to start the transfer
+            from pyrogram.errors import RPCError
+
+            if isinstance(e, (RPCError, ConnectionError, asyncio.TimeoutError)):
+                self.chunker.record(0, 0, failed=True)
+            raise
+
+        return result, time.monotonic() - started
 
 
     async def uploadFiles(self, fileData: dict):
-        tot_chunks = (fileData['size'] // self.chunk_size) + 1 # used by progress fun
-        self.now_transmitting = 1 if fileData['size'] <= self.chunk_size else 2
+        if not fileData['fileID']: # not resuming
+            fileData['chunkSize'] = self.chunker.choose(fileData['size'])
+        chunk_size = chunkSize(fileData)
+
+        tot_chunks = (fileData['size'] // chunk_size) + 1 # used by progress fun
+        self.now_transmitting = 1 if fileData['size'] <= chunk_size else 2
+
+        if self.encrypt and not fileData['fileID']: # not resuming
+            fileData['key'], fileData['iv'] = newKey()
+        if not 'channels' in fileData: # new upload or resume data from before sharding
+            fileData['channels'] = [self.telegram_channel_id] * len(fileData['fileID'])
+        if not fileData['fileID']:
+            # resume data from before fingerprints can't have them
+            fileData['fingerprints'] = []
+
+        # encrypted files are always copied, single chunk ones too
+        copy_chunk = self.now_transmitting == 2 or 'key' in fileData
 
         while True: # not end of file
-            if self.now_transmitting == 2:
+            expected = min(chunk_size, fileData['size'] - fileData['chunkIndex'])
+            hashing = None
+
+            if copy_chunk:
                 copied_file_path = path.join(self.tmp_path, "tfilemgr",
                     "{}_{}".format(self.s_file, fileData['index']))
 
+            # chunks that are copied are hashed while they are copied
+            if 'key' in fileData:
+                h = newHash()
+                fileData['chunkIndex'] = await self.crypto.encryptFile(
+                    fileData['chunkIndex'], fileData['path'], copied_file_path,
+                    chunk_size, fileData['key'], fileData['iv'], h=h
+                )
+                chunk_fingerprint = h.digest()
+            elif copy_chunk and 'fingerprints' in fileData:
+                chunk_fingerprint, copied = await self.asyncFiles.run(
+                    copied_file_path, copyChunk, fileData['path'], copied_file_path,
+                    fileData['chunkIndex'], chunk_size)
+
+                end = fileData['chunkIndex'] + copied
+                fileData['chunkIndex'] = end if end < fileData['size'] else 0
+            elif copy_chunk: # resume data from before fingerprints
                 fileData['chunkIndex'] = await self.asyncFiles.splitFile(
                     fileData['chunkIndex'],
                     fileData['path'].encode('ascii'),
                     copied_file_path.encode('ascii'),
-                    self.mul_chunk_size, 1024
+                    chunk_size // 1024, 1024
                 )
-
-            async with self.telegram:
-                msg_obj = await self.telegram.send_document(
-                        self.telegram_channel_id,
-                        copied_file_path if self.now_transmitting == 2 else \
-                            fileData['path'],
-                        file_name = None if self.now_transmitting == 2 else \
-                            "{}_{}".format(self.s_file, fileData['index']),
-                        progress=self.progress_fun,
-                        progress_args=(len(fileData['fileID']), tot_chunks,
-                                       self.s_file)
-                )
-
-            if self.now_transmitting == 2:
+            elif 'fingerprints' in fileData:
+                # pyrogram reads the file itself, it's hashed while uploading
+                hashing = asyncio.ensure_future(self.asyncFiles.run(
+                    fileData['path'], fingerprint, fileData['path'],
+                    fileData['chunkIndex'], chunk_size))
+
+            channel = self.placement.pick(fileData['rPath'], len(fileData['fileID']),
+                                          expected)
+
+            try:
+                async with self.connected():
+                    msg_obj, elapsed = await self._measured(self.telegram.send_document(
+                            channel,
+                            copied_file_path if copy_chunk else fileData['path'],
+                            file_name = None if copy_chunk else \
+                                "{}_{}".format(self.s_file, fileData['index']),
+                            progress=self.progress_fun,
+                            progress_args=(len(fileData['fileID']), tot_chunks,
+                                           self.s_file)
+                    ))
+            except BaseException:
+                self.placement.settle(channel, expected)
+                raise
+
+            self.placement.settle(channel, expected,
+                                  0 if self.should_stop == 2 else msg_obj.document.file_size)
+
+            if copy_chunk:
                 await self.asyncFiles.remove(copied_file_path)
                 # delete the chunk
 
+            if hashing:
+                chunk_fingerprint = await hashing
+
             if self.should_stop == 2: # force stop
                 if self.now_transmitting == 1:
                     self.should_stop = 0
                     return
                 break
 
+            self.chunker.record(msg_obj.document.file_size, elapsed)
             fileData['fileID'].append(msg_obj.message_id)
+            fileData['channels'].append(channel)
+            if 'fingerprints' in fileData:
+                fileData['fingerprints'].append(chunk_fingerprint)
             fileData['index'] += 1
 
             if not fileData['chunkIndex']: # reached EOF
@@ -126,24 +293,296 @@ class TransferHandler:
         self.should_stop = 0 # Set this to 0 no matter what
 
         if not fileData['chunkIndex']: # finished uploading
-            return {'fileData' : {'rPath'  : fileData['rPath'],
-                                  'fileID' : fileData['fileID'],
-                                  'size'   : fileData['size']},
+            return {'fileData' : self._entry(fileData),
                     'index'    : fileData['index']}
             # return file information
 
 
+    async def uploadChunks(self, fileData: dict, chunks: list) -> dict:
+        # Uploads only the given chunks of the file, used to send the chunks
+        # of a modified file that changed.
+        # Returns {chunk: (message_id, channel)} for the uploaded chunks,
+        # if cancelled not all of the chunks are in it
+        self.now_transmitting = 2
+        uploaded = {}
+        chunk_size = chunkSize(fileData)
+
+        for n, chunk in enumerate(chunks):
+            copied_file_path = path.join(self.tmp_path, "tfilemgr",
+                "{}_{}".format(self.s_file, fileData['index']))
+
+            await self.asyncFiles.splitFile(
+                chunk * chunk_size,
+                fileData['path'].encode('ascii'),
+                copied_file_path.encode('ascii'),
+                chunk_size // 1024, 1024
+            )
+
+            expected = min(chunk_size, fileData['size'] - chunk * chunk_size)
+            channel = self.placement.pick(fileData['rPath'], chunk, expected)
+
+            try:
+                async with self.connected():
+                    msg_obj = await self.telegram.send_document(
+                            channel,
+                            copied_file_path,
+                            progress=self.progress_fun,
+                            progress_args=(n, len(chunks), self.s_file)
+                    )
+            finally:
+                # the load of the new version is added by the caller
+                self.placement.settle(channel, expected)
+
+            await self.asyncFiles.remove(copied_file_path)
+
+            if self.should_stop == 2: # force stop
+                break
+
+            uploaded[chunk] = (msg_obj.message_id, channel)
+            fileData['index'] += 1
+
+            if self.should_stop == 1:
+                break
+
+        self.now_transmitting = 0
+        self.should_stop = 0
+
+        return uploaded
+
+
+    async def uploadSmallFiles(self, fileList: list, index: int, uploaded: list) -> int:
+        # Uploads files smaller than a chunk as media groups of up to 10
+        # documents, group_concurrency groups are uploaded at the same time.
+        # Empty files can't be sent, their entries have no messages.
+        # The database entries of the uploaded files are appended to
+        # uploaded as every group finishes, returns the next index
+        from pyrogram.types import InputMediaDocument
+
+        for fileData in fileList:
+            fileData['index'] = index
+            fileData['tmpPath'] = path.join(self.tmp_path, "tfilemgr",
+                "{}_{}".format(self.s_file, index))
+            index += 1
+
+        for fileData in [i for i in fileList if not i['size']]:
+            fileData['fileID'] = []
+            fileData['channels'] = []
+            fileData['fingerprints'] = [newHash().digest()]
+            uploaded.append(self._entry(fileData))
+
+        fileList = [i for i in fileList if i['size']]
+        groups = [fileList[i:i+10] for i in range(0, len(fileList), 10)]
+        tot_size = sum(i['size'] for i in fileList)
+        current = [0]
+
+        async def prepare(fileData):
+            # the document name is the name of the file sent, so it is
+            # linked (or copied, or encrypted) as <s_file>_<index>
+            if self.encrypt:
+                fileData['key'], fileData['iv'] = newKey()
+                await self.crypto.encryptFile(0, fileData['path'], fileData['tmpPath'],
+                                              fileData['size'], fileData['key'], fileData['iv'])
+            else:
+                try:
+                    symlink(path.abspath(fileData['path']), fileData['tmpPath'])
+                except OSError: # not supported
+                    await self.asyncFiles.run(fileData['tmpPath'], copyfile,
+                                              fileData['path'], fileData['tmpPath'])
+
+            fileData['fingerprints'] = [await self.asyncFiles.run(
+                fileData['path'], fingerprint, fileData['path'], 0, fileData['size'])]
+
+        async def send_group(group):
+            # the files are staged just before their group is sent, so at
+            # most group_concurrency groups are in tmp_path at a time
+            try:
+                for fileData in group:
+                    await prepare(fileData)
+
+                expected = sum(i['size'] for i in group)
+                channel = self.placement.pick(group[0]['rPath'], 0, expected)
+
+                try:
+                    messages = await self.telegram.send_media_group(
+                        channel, [InputMediaDocument(i['tmpPath']) for i in group])
+                except BaseException:
+                    self.placement.settle(channel, expected)
+                    raise
+            finally:
+                for fileData in group:
+                    if path.lexists(fileData['tmpPath']):
+                        await self.asyncFiles.remove(fileData['tmpPath'])
+
+            # the order of the messages isn't guaranteed, they are matched
+            # to the files by the document name
+            byName = {i.document.file_name: i for i in messages if i.document}
+            missing = []
+            sent = 0
+
+            for fileData in group:
+                message = byName.get(path.basename(fileData['tmpPath']))
+                if not message:
+                    missing.append(fileData['path'])
+                    continue
+
+                fileData['fileID'] = [message.message_id]
+                fileData['channels'] = [channel]
+                uploaded.append(self._entry(fileData))
+                sent += fileData['size']
+
+            self.placement.settle(channel, expected, sent)
+
+            if missing:
+                raise ValueError("No message was returned for {}.".format(', '.join(missing)))
+
+            current[0] += sum(i['size'] for i in group)
+            self.progress_fun(current[0], tot_size, 0, 1, self.s_file)
+
+        self.now_transmitting = 1
+
+        try:
+            async with self.connected():
+                for i in range(0, len(groups), self.group_concurrency):
+                    # every group finishes before an error is raised, so
+                    # none of them is sent after the entries are saved
+                    results = await asyncio.gather(
+                        *[send_group(j) for j in groups[i:i+self.group_concurrency]],
+                        return_exceptions=True)
+
+                    for result in results:
+                        if isinstance(result, BaseException):
+                            raise result
+
+                    if self.should_stop:
+                        break
+        finally:
+            self.now_transmitting = 0
+            self.should_stop = 0
+
+        return index
+
+
+    async def uploadStream(self, fileData: dict, stream):
+        # Uploads everything read from stream (a binary file object like
+        # stdin) until EOF, the size doesn't need to be known beforehand.
+        # The next chunk is read while the current one is uploading, so at
+        # most 2 chunks are on disk at a time
+        self.now_transmitting = 2
+        fileData['size'] = 0
+
+        if self.encrypt:
+            fileData['key'], fileData['iv'] = newKey()
+        fileData['channels'] = []
+        fileData['fingerprints'] = []
+        # the size of the stream isn't known, so it's only chosen by the link
+        fileData['chunkSize'] = self.chunker.choose()
+        max_size = fileData['chunkSize']
+
+        def read_chunk(chunk_path):
+            # returns how many bytes were written to chunk_path
+            # and the fingerprint of the chunk
+            chunk_size = 0
+            h = newHash()
+            with open(chunk_path, 'wb') as f:
+                while chunk_size < max_size:
+                    data = stream.read(min(1024*1024, max_size - chunk_size))
+                    if not data:
+                        break
+                    h.update(data)
+                    if 'key' in fileData:
+                        # fileData['size'] is where the current chunk starts
+                        data = ctr(data, fileData['key'], fileData['iv'],
+                                   fileData['size'] + chunk_size)
+                    f.write(data)
+                    chunk_size += len(data)
+
+            return chunk_size, h.digest()
+
+        copied_file_path = path.join(self.tmp_path, "tfilemgr",
+            "{}_{}".format(self.s_file, fileData['index']))
+        chunk_size, chunk_fingerprint = await self.asyncFiles.run(
+            copied_file_path, read_chunk, copied_file_path)
+
+        if not chunk_size:
+            await self.asyncFiles.remove(copied_file_path)
+            self.now_transmitting = 0
+            raise ValueError("Can't upload an empty stream.")
+
+        async with self.connected():
+            while chunk_size:
+                fileData['size'] += chunk_size
+
+                reading = None
+                if chunk_size == max_size: # stream might continue
+                    next_file_path = path.join(self.tmp_path, "tfilemgr",
+                        "{}_{}".format(self.s_file, fileData['index'] + 1))
+                    reading = asyncio.ensure_future(self.asyncFiles.run(
+                        next_file_path, read_chunk, next_file_path))
+
+                channel = self.placement.pick(fileData['rPath'], len(fileData['fileID']),
+                                              chunk_size)
+
+                try:
+                    msg_obj, elapsed = await self._measured(self.telegram.send_document(
+                            channel,
+                            copied_file_path,
+                            progress=self.progress_fun,
+                            # the total is unknown, show the current chunk's progress
+                            progress_args=(0, 1, self.s_file)
+                    ))
+                except BaseException:
+                    self.placement.settle(channel, chunk_size)
+                    raise
+
+                self.placement.settle(channel, chunk_size,
+                                      0 if self.should_stop == 2 else chunk_size)
+
+                await self.asyncFiles.remove(copied_file_path)
+
+                if self.should_stop == 2: # force stop
+                    if reading:
+                        await reading
+                        await self.asyncFiles.remove(next_file_path)
+                    break
+
+                self.chunker.record(chunk_size, elapsed)
+                fileData['fileID'].append(msg_obj.message_id)
+                fileData['channels'].append(channel)
+                fileData['fingerprints'].append(chunk_fingerprint)
+                fileData['index'] += 1
+
+                if not reading: # reached EOF
+                    break
+
+                chunk_size, chunk_fingerprint = await reading
+                copied_file_path = next_file_path
+
+                if not chunk_size: # EOF was exactly at the end of a chunk
+                    await self.asyncFiles.remove(copied_file_path)
+
+        self.now_transmitting = 0
+
+        if self.should_stop:
+            self.should_stop = 0
+            return
+
+        return {'fileData' : self._entry(fileData),
+                'index'    : fileData['index']}
+
+
     async def downloadFiles(self, fileData: dict):
-        self.now_transmitting = 1 if fileData['size'] <= self.chunk_size else 2
+        chunk_size = chunkSize(fileData)
+        self.now_transmitting = 1 if fileData['size'] <= chunk_size else 2
 
-        if self.download_full_path:
+        # fullPath is set by batch downloads, they always keep the rPath layout
+        if fileData.get('fullPath', self.download_full_path):
             final_dir_path = path.join(fileData['dPath'], *fileData['rPath'][:-1]) if fileData['dPath'] else \
                              path.join(self.data_path, "downloads", *fileData['rPath'][:-1])
 
             final_file_path = path.join(fileData['dPath'], *fileData['rPath']) if fileData['dPath'] else \
                               path.join(self.data_path, "downloads", *fileData['rPath'])
             tmp_file_path = path.join(self.tmp_path, "tfilemgr",
-                                      "{}_chunk".format(fileData['rPath'][-1]))
+                                      "{}_{}_chunk".format(self.s_file, fileData['rPath'][-1]))
 
             if not path.isdir(final_dir_path):
                 makedirs(final_dir_path)
@@ -151,26 +590,58 @@ class TransferHandler:
             final_file_path = path.join(fileData['dPath'], fileData['rPath'][-1]) if fileData['dPath'] else \
                               path.join(self.data_path, "downloads", fileData['rPath'][-1])
             tmp_file_path = path.join(self.tmp_path, "tfilemgr",
-                                      "{}_chunk".format(fileData['rPath'][-1]))
+                                      "{}_{}_chunk".format(self.s_file, fileData['rPath'][-1]))
+
+        if not fileData['fileID']: # empty files have no messages
+            open(final_file_path, 'wb').close()
+
+        # encrypted chunks are always decrypted from tmp_file_path
+        copy_chunk = self.now_transmitting == 2 or 'key' in fileData
+
+        if copy_chunk and not fileData['IDindex'] and path.isfile(final_file_path):
+            # chunks are appended, so a file left by an interrupted
+            # download that wasn't saved as resume data is started over
+            await self.asyncFiles.remove(final_file_path)
 
         while fileData['IDindex'] < len(fileData['fileID']):
-            async with self.telegram:
-                message = await self.telegram.get_messages(self.telegram_channel_id,
-                                            fileData['fileID'][fileData['IDindex']])
-
-                await message.download(
-                    file_name=final_file_path if self.now_transmitting == 1 else tmp_file_path,
-                    progress=self.progress_fun,
-                    progress_args=(fileData['IDindex'], len(fileData['fileID']),
-                                   self.s_file)
-                )
+            async with self.connected():
+                message = await self.telegram.get_messages(
+                    self.placement.chunkChannel(fileData, fileData['IDindex']),
+                    fileData['fileID'][fileData['IDindex']])
+
+                if self.parts_in_flight > 1:
+                    transfer = self.parts.download(
+                        message, tmp_file_path if copy_chunk else final_file_path,
+                        self.connections, self.parts_in_flight,
+                        progress=self.progress_fun,
+                        progress_args=(fileData['IDindex'], len(fileData['fileID']),
+                                       self.s_file),
+                        should_stop=lambda: self.should_stop == 2
+                    )
+                else:
+                    transfer = message.download(
+                        file_name=tmp_file_path if copy_chunk else final_file_path,
+                        progress=self.progress_fun,
+                        progress_args=(fileData['IDindex'], len(fileData['fileID']),
+                                       self.s_file)
+                    )
+
+                _, elapsed = await self._measured(transfer)
 
             if self.should_stop == 2: # force stop
                 break
 
+            self.chunker.record(message.document.file_size, elapsed)
             fileData['IDindex']+=1
 
-            if self.now_transmitting == 2:
+            if 'key' in fileData:
+                await self.crypto.decryptAppend(
+                    tmp_file_path, final_file_path,
+                    (fileData['IDindex'] - 1) * chunk_size,
+                    fileData['key'], fileData['iv']
+                )
+                await self.asyncFiles.remove(tmp_file_path)
+            elif self.now_transmitting == 2:
                 await self.asyncFiles.concatFiles(
                     tmp_file_path.encode('ascii'),
                     final_file_path.encode('ascii'),
@@ -199,26 +670,159 @@ class TransferHandler:
         return 1
 
 
-    async def deleteUseless(self, IDList: list, mode: int = 1):
-        # mode is 1 for everything except IDList,
-        #         2 for only IDList
+    async def iterRange(self, fileData: dict, start: int, end: int, readAhead: int = 1):
+        # yields the bytes of the file from start to end (not included),
+        # only the chunks that overlap the range are requested.
+        # The client must already be started
+        offset = start # used to decrypt the data
+        chunk_size = chunkSize(fileData)
+
+        for chunk in range(start // chunk_size, (end - 1) // chunk_size + 1):
+            chunk_start = chunk * chunk_size
+
+            message = await self.telegram.get_messages(
+                self.placement.chunkChannel(fileData, chunk), fileData['fileID'][chunk])
+
+            parts = self.parts.iterRange(
+                message, max(start, chunk_start) - chunk_start,
+                min(end, chunk_start + chunk_size) - chunk_start,
+                readAhead)
+
+            try:
+                async for data in parts:
+                    if 'key' in fileData:
+                        data = await self.crypto.crypt(data, fileData['key'],
+                                                       fileData['iv'], offset)
+                    offset += len(data)
+                    yield data
+
+                    if self.should_stop:
+                        return
+            finally:
+                # cancels the parts requested ahead
+                await parts.aclose()
+
+
+    async def downloadRange(self, fileData: dict, start: int, end: int, out_path: str):
+        # Downloads only the bytes from start to end of the file to out_path
+        if not 0 <= start < end <= fileData['size']:
+            raise IndexError("The range should be inside the file.")
+
+        self.now_transmitting = 1 if end - start <= chunkSize(fileData) else 2
+        current = 0
+
+        with open(out_path, 'wb') as f:
+            async with self.connected():
+                chunks = self.iterRange(fileData, start, end, self.read_ahead)
+                try:
+                    async for data in chunks:
+                        await self.asyncFiles.run(out_path, f.write, data,
+                                                  priority=FOREGROUND)
+                        current += len(data)
+                        self.progress_fun(current, end - start, 0, 1, self.s_file)
+                finally: # a failed write doesn't leave parts downloading
+                    await chunks.aclose()
+
+        self.now_transmitting = 0
+
+        if self.should_stop:
+            self.should_stop = 0
+            return 0
+
+        return 1
+
+
+    async def deleteUseless(self, IDDict: dict, mode: int = 1):
+        # IDDict has the list of message IDs for every channel
+        # mode is 1 for everything except IDDict, in all channels
+        #         2 for only IDDict
         deletedList = []
 
-        async with self.telegram:
+        async with self.connected():
             if mode == 1:
-                async for tFile in self.telegram.iter_history(self.telegram_channel_id):
-                    if (tFile.media) and (not tFile.message_id in IDList):
-                        deletedList.append(tFile.message_id)
+                for channel in self.placement.channels:
+                    keepIDs = set(IDDict.get(channel, ()))
+                    channelDeleted = []
+
+                    async for tFile in self.telegram.iter_history(channel):
+                        if (tFile.media) and (not tFile.message_id in keepIDs):
+                            channelDeleted.append(tFile.message_id)
 
-                if deletedList:
-                    await self.telegram.delete_messages(self.telegram_channel_id,
-                                                        deletedList)
+                    if channelDeleted:
+                        await self.telegram.delete_messages(channel, channelDeleted)
+                    deletedList.extend(channelDeleted)
 
             elif mode == 2:
-                await self.telegram.delete_messages(self.telegram_channel_id, IDList)
+                for channel, IDList in IDDict.items():
+                    await self.telegram.delete_messages(channel, IDList)
 
         return deletedList
 
+    async def sendBytes(self, channel, name: str, data: bytes) -> int:
+        # Sends data as a document called name, returns its message ID
+        stream = BytesIO(data)
+        stream.name = name
+
+        async with self.connected():
+            msg_obj = await self.telegram.send_document(channel, stream, file_name=name)
+
+        return msg_obj.message_id
+
+
+    async def readBytes(self, channel, ID: int) -> bytes:
+        # The contents of a document sent with sendBytes
+        async with self.connected():
+            message = await self.telegram.get_messages(channel, ID)
+            if message.empty or not message.document:
+                raise ValueError("Message {} doesn't exist.".format(ID))
+
+            return b''.join([data async for data in self.parts.iterRange(
+                message, 0, message.document.file_size, self.read_ahead)])
+
+
+    async def getPinned(self, channel) -> str:
+        # the text of the pinned message of the channel
+        async with self.connected():
+            chat = await self.telegram.get_chat(channel)
+
+        if chat.pinned_message and chat.pinned_message.text:
+            return chat.pinned_message.text
+
+
+    async def setPinned(self, channel, text: str, prefix: str):
+        # Edits the pinned message if it was sent by this account and
+        # starts with prefix, otherwise sends and pins a new one
+        async with self.connected():
+            chat = await self.telegram.get_chat(channel)
+            pinned = chat.pinned_message
+
+            if pinned and pinned.outgoing and (pinned.text or '').startswith(prefix):
+                if pinned.text != text:
+                    await self.telegram.edit_message_text(channel, pinned.message_id, text)
+            else:
+                msg_obj = await self.telegram.send_message(channel, text)
+                await self.telegram.pin_chat_message(channel, msg_obj.message_id,
+                                                     disable_notification=True)
+
+
+    async def getMessages(self, channel, IDList: list) -> list:
+        async with self.connected():
+            return await self.telegram.get_messages(channel, IDList)
+
+
+    async def mediaIDs(self, channel, limit: int, offsetID: int = 0) -> tuple:
+        # One page of up to limit messages older than offsetID (0 starts
+        # from the newest one). Returns the IDs and dates (unix time) of the
+        # messages with media and the offsetID of the next page, 0 after
+        # the last one
+        async with self.connected():
+            messages = await self.telegram.get_history(channel, limit=limit,
+                                                       offset_id=offsetID)
+
+        IDList = [(i.message_id, i.date) for i in messages if i.media]
+        return IDList, messages[-1].message_id if messages else 0
+
+
     async def stop(self, stop_type: int):
         # Values of stop_type:
         # 1 - Wait until the current chunk transfer ended and appended
@@ -230,5 +834,5 @@ class TransferHandler:
 
         self.should_stop = stop_type
         if stop_type == 2: # force stop
-            async with self.telegram:
+            async with self.connected():
                 await self.telegram.stop_transmission()
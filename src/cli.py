@@ -1,6 +1,7 @@
 import urwid
 import os
 import weakref
+import logging
 import asyncio
 import sys
 
@@ -46,15 +47,131 @@ class CustomColumns(urwid.Columns):
             self.info = info
 
 
+class FileTreeWidget(urwid.TreeWidget):
+    signals = ['click', 'download', 'range', 'delete', 'rename']
+
+    def __init__(self, node, actionDict):
+        super().__init__(node)
+        self.actionDict = actionDict
+
+        if not self.is_leaf and node.get_depth():
+            # only the root starts expanded, the others load when needed
+            self.expanded = False
+            self.update_expanded_icon()
+
+    def get_display_text(self):
+        value = self.get_node().get_value()
+
+        if self.is_leaf:
+            return "{}  {}".format(value['rPath'][-1], bytesConvert(value['size']))
+
+        return "{}/  {} - {} files".format(value.name, bytesConvert(value.size), value.count)
+
+    def keypress(self, size, key):
+        if key == 'enter' and not self.is_leaf:
+            self.expanded = not self.expanded
+            self.update_expanded_icon()
+        elif key in self.actionDict:
+            self._emit(self.actionDict[key])
+        else:
+            return super().keypress(size, key)
+
+
+class FileNode(urwid.TreeNode):
+    def __init__(self, fileData, ui, dpath, parent = None, key = None, depth = None):
+        self.ui = ui
+        self.dpath = dpath
+        super().__init__(fileData, parent=parent, key=key, depth=depth)
+
+    def load_widget(self):
+        fileData = self.get_value()
+        widget = FileTreeWidget(self, {'enter' : 'click',
+                                       'p'     : 'range',
+                                       'd'     : 'delete',
+                                       'r'     : 'rename'})
+
+        urwid.connect_signal(widget, 'click', self.ui.download_in_loop,
+            weak_args=[self.dpath], user_args=[fileData]
+        )
+
+        urwid.connect_signal(widget, 'range', self.ui.change_widget,
+            user_args=[self.ui.build_range_widget, self.ui.handle_keys_null,
+                       {'fileData': fileData, 'dPath': self.dpath}]
+        )
+
+        urwid.connect_signal(widget, 'rename', self.ui.change_widget,
+            user_args=[self.ui.build_rename_widget, self.ui.handle_keys_null,
+                       {'fileData': fileData}]
+        )
+
+        urwid.connect_signal(widget, 'delete', self.ui.change_widget,
+            user_args=[self.ui.build_delete_widget, self.ui.handle_keys_null,
+                       {'fileData': fileData}]
+        )
+
+        return widget
+
+
+class DirectoryNode(urwid.ParentNode):
+    def __init__(self, dirNode, ui, dpath, parent = None, key = None, depth = None):
+        self.ui = ui
+        self.dpath = dpath
+        super().__init__(dirNode, parent=parent, key=key, depth=depth)
+
+    def load_widget(self):
+        widget = FileTreeWidget(self, {'g' : 'download', 'd' : 'delete'})
+        rPath = self.get_value().path()
+
+        urwid.connect_signal(widget, 'download', self.ui.download_tree_in_loop,
+            weak_args=[self.dpath], user_args=[rPath]
+        )
+
+        urwid.connect_signal(widget, 'delete', self.ui.change_widget,
+            user_args=[self.ui.build_delete_widget, self.ui.handle_keys_null,
+                       {'rPath': rPath}]
+        )
+
+        return widget
+
+    def load_child_keys(self):
+        # directories first, then files, both sorted by name
+        dirNode = self.get_value()
+        return [('d', i) for i in sorted(dirNode.dirs)] + \
+               [('f', i) for i in sorted(range(len(dirNode.files)),
+                                         key=lambda x: dirNode.files[x]['rPath'][-1])]
+
+    def load_child_node(self, key):
+        dirNode = self.get_value()
+
+        if key[0] == 'd':
+            return DirectoryNode(dirNode.dirs[key[1]], self.ui, self.dpath,
+                                 parent=self, key=key, depth=self.get_depth() + 1)
+
+        return FileNode(dirNode.files[key[1]], self.ui, self.dpath,
+                        parent=self, key=key, depth=self.get_depth() + 1)
+
+
 class UserInterface(SessionsHandler):
     def __init__(self):
         super().__init__(False if (len(sys.argv) > 1 and sys.argv[1] == '1') else True)
 
         self.notifInfo = {'buffer': '', 'timer': 0, 'endTimer': 6}
 
+        # warnings would be drawn over the UI, they go to data_path/log
+        logging.basicConfig(filename=os.path.join(self.fileIO.cfg['paths']['data_path'], 'log'),
+                            format='%(asctime)s %(name)s: %(message)s')
+
         self.loop = asyncio.get_event_loop()
 
-        self.loop.create_task(self.initSessions())
+        self.loop.create_task(self.connect_sessions())
+
+        scrub_every = self.fileIO.cfg.getfloat('transfer', 'scrub_every', fallback=0)
+        if scrub_every:
+            self.loop.call_later(scrub_every*3600, self.scrub_periodically, scrub_every)
+
+        replicate_every = self.fileIO.cfg.getfloat('telegram', 'replicate_every', fallback=0)
+        if replicate_every:
+            self.loop.call_later(replicate_every*60, self.replicate_periodically, replicate_every)
 
         self.main_widget = self.build_main_widget()
 
@@ -68,7 +185,15 @@ class UserInterface(SessionsHandler):
 
                             {'keybind' : self.fileIO.cfg['keybinds']['resume'],
                              'widget' : self.build_resume_widget,
-                             'input' : self.handle_keys_null}]
+                             'input' : self.handle_keys_null},
+
+                            {'keybind' : self.fileIO.cfg['keybinds'].get('sync', 's'),
+                             'widget' : self.build_sync_widget,
+                             'input' : self.handle_keys_null},
+
+                            {'keybind' : self.fileIO.cfg['keybinds'].get('scrub', 'v'),
+                             'widget' : self.scrub_in_loop,
+                             'input' : self.handle_keys_main}]
 
         palette = [('boldtext', 'default,bold', 'default', 'bold'), ('reversed', 'standout', '')]
 
@@ -81,6 +206,15 @@ class UserInterface(SessionsHandler):
         )
 
 
+    async def connect_sessions(self):
+        # the sessions that can't connect are shown instead of failing
+        # in the background
+        errors = await self.initSessions()
+        if errors:
+            self.notification("Sessions {} couldn't connect: {}".format(
+                ', '.join(sorted(errors, key=int)), next(iter(errors.values()))))
+
+
     def notification(self, inStr: str):
         self.notifInfo['buffer'] = inStr
         self.notifInfo['timer'] = 0
@@ -112,8 +246,15 @@ class UserInterface(SessionsHandler):
                 # widget is dead, the main loop must've been destroyed
                 return
 
-            local_used_sessions.set_text("[ {} of {} ]".format(int(self.fileIO.cfg['telegram']['max_sessions']) - len(self.freeSessions),
-                                                               int(self.fileIO.cfg['telegram']['max_sessions'])))
+            # sessions that failed connect again when they are used
+            failed = len([i for i in self.initErrors if not self.tHandler[i].initialized])
+            warming_up = int(self.fileIO.cfg['telegram']['max_sessions']) - self.readySessions() \
+                         - failed
+            local_used_sessions.set_text("{}{}[ {} of {} ]".format(
+                "{} connecting ".format(warming_up) if warming_up else '',
+                "{} failed ".format(failed) if failed else '',
+                int(self.fileIO.cfg['telegram']['max_sessions']) - len(self.freeSessions),
+                int(self.fileIO.cfg['telegram']['max_sessions'])))
 
             if self.notifInfo['buffer']:
                 if not self.notifInfo['timer']: # new notification
@@ -189,66 +330,63 @@ class UserInterface(SessionsHandler):
     def build_upload_widget(self):
         fpath = urwid.Edit(('boldtext', "File Path:\n"))
         rpath = urwid.Edit(('boldtext', "Relative Path:\n"))
+        delta = urwid.CheckBox("Replace the file with this path, uploading only changed chunks")
 
         upload = urwid.Button("Upload")
         urwid.connect_signal(upload, 'click', self.upload_in_loop,
-            weak_args=[fpath, rpath])
+            weak_args=[fpath, rpath, delta])
 
         cancel = urwid.Button("Cancel", self.return_to_main)
 
         div = urwid.Divider()
-        pile = urwid.Pile([fpath, div, rpath, div,
+        pile = urwid.Pile([fpath, div, rpath, div, delta, div,
                            urwid.AttrMap(upload, None, focus_map='reversed'),
                            urwid.AttrMap(cancel, None, focus_map='reversed')])
 
         return urwid.Filler(pile, 'top')
 
 
-    def build_download_widget(self):
-        totalSize = 0
-
-        dpath = urwid.Edit(('boldtext', "Download path: "),
-            os.path.join(self.fileIO.cfg['paths']['data_path'], 'downloads'))
+    def build_sync_widget(self):
+        lpath = urwid.Edit(('boldtext', "Local Directory:\n"))
+        rpath = urwid.Edit(('boldtext', "Relative Path:\n"))
+        inode = urwid.CheckBox("Compare inodes")
+        prune = urwid.CheckBox("Delete files that don't exist locally")
 
-        body = [dpath, urwid.Divider()]
+        sync = urwid.Button("Sync")
+        urwid.connect_signal(sync, 'click', self.sync_in_loop,
+            weak_args=[lpath, rpath, inode, prune])
 
-        for i in self.fileDatabase:
-            totalSize += i['size']
+        cancel = urwid.Button("Cancel", self.return_to_main)
 
-            button = CustomButton("{}  {}".format(
-                                    '/'.join(i['rPath']),
-                                    bytesConvert(i['size'])),
-                                  {'enter' : 'click',
-                                   'd'     : 'delete',
-                                   'r'     : 'rename'})
+        div = urwid.Divider()
+        pile = urwid.Pile([lpath, div, rpath, div, inode, prune, div,
+                           urwid.AttrMap(sync, None, focus_map='reversed'),
+                           urwid.AttrMap(cancel, None, focus_map='reversed')])
 
-            urwid.connect_signal(button, 'click', self.download_in_loop,
-                weak_args=[dpath],
-                user_args=[i['rPath'], i['fileID'], i['size']]
-            )
+        return urwid.Filler(pile, 'top')
 
-            fileData_tmp = {'fileData': {'rPath': i['rPath'], 'fileID': i['fileID'], 'size': i['size']}}
 
-            urwid.connect_signal(button, 'rename', self.change_widget,
-                user_args=[self.build_rename_widget, self.handle_keys_null,
-                           fileData_tmp]
-            )
+    def build_download_widget(self):
+        dpath = urwid.Edit(('boldtext', "Download path: "),
+            os.path.join(self.fileIO.cfg['paths']['data_path'], 'downloads'))
 
-            urwid.connect_signal(button, 'delete', self.change_widget,
-                user_args=[self.build_delete_widget, self.handle_keys_null,
-                           fileData_tmp]
-            )
+        header = urwid.Text(
+            ('reversed', "Enter to download/expand, g to download directory, "
+                         "p to download part, d to delete, r to rename - {} Total".format(
+                bytesConvert(self.fileTree.root.size)
+            ))
+        )
 
-            body.append(button)
+        # Only the root is loaded here, directories load their children
+        # when they get expanded
+        treeBox = urwid.TreeListBox(urwid.TreeWalker(
+            DirectoryNode(self.fileTree.root, self, dpath)))
 
-        body.insert(0, urwid.Text(
-            ('reversed', "Enter to download, d to delete, r to rename - {} Total".format(
-                bytesConvert(totalSize)
-            ))
-        ))
+        pile = urwid.Pile([('pack', header), ('pack', dpath),
+                           ('pack', urwid.Divider()), treeBox])
+        pile.focus_position = 3
 
-        listBox = urwid.ListBox(urwid.SimpleFocusListWalker(body))
-        return urwid.Padding(listBox, left=2, right=2)
+        return urwid.Padding(pile, left=2, right=2)
 
 
     def build_resume_widget(self):
@@ -302,6 +440,35 @@ class UserInterface(SessionsHandler):
                 pile.contents.append((transfer_columns, pack_option))
                 pile.contents.append((div, pack_option))
 
+        for batchName, batch in self.batchData.items():
+            if not batchName in self.runningBatches:
+                # failed is set by the last run of the batch
+                batch_name = urwid.Text("Directory '{}/' - {} files left{}:".format(
+                    batchName, len(batch['pending']),
+                    ", {} failed".format(len(batch['failed'])) if batch.get('failed') else ''))
+
+                resume = urwid.Button("Resume")
+                urwid.connect_signal(resume, 'click', self.resume_batch_in_loop,
+                                     weak_args=[pile],
+                                     user_args=[batchName, True]
+                )
+
+                delete = urwid.Button("Delete")
+                urwid.connect_signal(delete, 'click', self.resume_batch_in_loop,
+                                     weak_args=[pile],
+                                     user_args=[batchName, False]
+                )
+
+                option_pile = urwid.Pile([urwid.AttrMap(resume, None, focus_map='reversed'),
+                                          urwid.AttrMap(delete, None, focus_map='reversed')])
+
+                batch_columns = CustomColumns([('weight', 4, batch_name),
+                                               ('weight', 1, option_pile)], 1,
+                                              {'batch': batchName})
+
+                pile.contents.append((batch_columns, pack_option))
+                pile.contents.append((div, pack_option))
+
         if len(pile.contents) == 2:
             self.notification("No resume information")
             # the function that called this function always expects it to
@@ -331,12 +498,41 @@ class UserInterface(SessionsHandler):
         return urwid.Filler(pile, 'top')
 
 
-    def build_delete_widget(self, fileData):
-        confirm_text = urwid.Text(('boldtext', "Are you sure you want to delete {}?".format(
-            '/'.join(fileData['rPath']))))
+    def build_range_widget(self, fileData, dPath):
+        title = urwid.Text(('boldtext', "Download part of {} ({} Bytes)".format(
+            '/'.join(fileData['rPath']), fileData['size'])))
+        start = urwid.IntEdit(('boldtext', "Start (bytes):\n"), 0)
+        length = urwid.IntEdit(('boldtext', "Length (bytes):\n"), fileData['size'])
+        dpath = urwid.Edit(('boldtext', "Download path:\n"), dPath.edit_text)
+
+        download = urwid.Button("Download")
+        urwid.connect_signal(download, 'click', self.download_range_in_loop,
+            weak_args=[dpath, start, length], user_args=[fileData])
+
+        cancel = urwid.Button("Cancel", self.return_to_main)
+
+        div = urwid.Divider()
+        pile = urwid.Pile([title, div, start, div, length, div, dpath, div,
+                           urwid.AttrMap(download, None, focus_map='reversed'),
+                           urwid.AttrMap(cancel, None, focus_map='reversed')])
+
+        return urwid.Filler(pile, 'top')
+
+
+    def build_delete_widget(self, fileData = None, rPath = None):
+        # Deletes a single file if fileData is given, else the rPath directory
+        if fileData:
+            confirm_text = urwid.Text(('boldtext', "Are you sure you want to delete {}?".format(
+                '/'.join(fileData['rPath']))))
+        else:
+            confirm_text = urwid.Text(('boldtext', "Are you sure you want to delete {}/ and everything in it?".format(
+                '/'.join(rPath))))
 
         delete = urwid.Button("Delete")
-        urwid.connect_signal(delete, 'click', self.delete_in_loop, user_args=[fileData])
+        if fileData:
+            urwid.connect_signal(delete, 'click', self.delete_in_loop, user_args=[fileData])
+        else:
+            urwid.connect_signal(delete, 'click', self.delete_tree_in_loop, user_args=[rPath])
 
         cancel = urwid.Button("Cancel", self.return_to_main)
 
@@ -374,7 +570,7 @@ class UserInterface(SessionsHandler):
         self.urwid_loop.unhandled_input = self.handle_keys_main
 
 
-    def upload_in_loop(self, path, rPath, key):
+    def upload_in_loop(self, path, rPath, delta, key):
         path_str = path.edit_text
         rPath_str = rPath.edit_text
 
@@ -384,6 +580,12 @@ class UserInterface(SessionsHandler):
             self.notification("Please enter all info")
         elif not os.path.isfile(path_str):
             self.notification("There is no file with this path")
+        elif delta.get_state():
+            oldData = self.findFile(rPath_str.split('/'))
+            if oldData:
+                self.loop.create_task(self.uploadDelta(oldData, path_str))
+            else:
+                self.notification("There is no uploaded file with this path")
         else:
             self.loop.create_task(self.upload({
                 'rPath'   : rPath_str.split('/'),
@@ -395,17 +597,91 @@ class UserInterface(SessionsHandler):
         self.return_to_main()
 
 
-    def download_in_loop(self, dPath, rPath, fileID, size, key):
+    def sync_in_loop(self, lPath, rPath, inode, prune, key):
+        async def sync(lPath_str, rPath_list, useInode, prune):
+            result = await self.syncDirectory(lPath_str, rPath_list, useInode, prune)
+            self.notification("Synced {}: {} changed, {} failed".format(
+                lPath_str, result['changed'], result['failed']))
+
+        lPath_str = lPath.edit_text
+        rPath_str = rPath.edit_text
+
+        if not lPath_str:
+            self.notification("Please enter all info")
+        elif not os.path.isdir(lPath_str):
+            self.notification("There is no directory with this path")
+        else:
+            self.loop.create_task(sync(lPath_str,
+                rPath_str.split('/') if rPath_str else [],
+                inode.get_state(), prune.get_state()))
+
+        self.return_to_main()
+
+
+    def scrub_in_loop(self):
+        """
+        Starts checking the messages of the database in the background,
+        returns the main widget as nothing has to be shown until it finishes
+        """
+
+        async def scrub():
+            self.notification("Started checking the database")
+            result = await self.scrub(orphans=True)
+            self.notification("Checked {} chunks: {} missing, {} wrong size, {} orphans".format(
+                result['checked'], len(result['missing']), len(result['wrongSize']),
+                len(result['orphans'])))
+
+        self.loop.create_task(scrub())
+        return self.main_widget
+
+
+    def scrub_periodically(self, scrub_every):
+        self.scrub_in_loop()
+        self.loop.call_later(scrub_every*3600, self.scrub_periodically, scrub_every)
+
+
+    def replicate_periodically(self, replicate_every):
+        async def replicate():
+            try:
+                await self.replicateCatalog()
+            except ValueError as e: # the passphrase isn't set
+                self.notification(str(e))
+
+        self.loop.create_task(replicate())
+        self.loop.call_later(replicate_every*60, self.replicate_periodically, replicate_every)
+
+
+    def download_in_loop(self, dPath, fileData, key):
         if not self.freeSessions:
             self.notification("All sessions are currently used")
         else:
-            self.loop.create_task(self.download({
-                'rPath'   : rPath,
-                'dPath'   : dPath.edit_text,
-                'fileID'  : fileID,
-                'size'    : size,
-                'type'    : 'download'
-            }))
+            self.loop.create_task(self.download(
+                self.downloadData(fileData, dPath.edit_text)))
+
+        self.return_to_main()
+
+
+    def download_range_in_loop(self, dPath, start, length, fileData, key):
+        start_int = start.value()
+        end_int = start_int + length.value()
+
+        if not self.freeSessions:
+            self.notification("All sessions are currently used")
+        elif not start_int < end_int <= fileData['size']:
+            self.notification("The range should be inside the file")
+        else:
+            self.loop.create_task(self.downloadRange(fileData, start_int,
+                                                     end_int, dPath.edit_text))
+
+        self.return_to_main()
+
+
+    def download_tree_in_loop(self, dPath, rPath, key):
+        if not self.freeSessions:
+            self.notification("All sessions are currently used")
+        else:
+            self.loop.create_task(self.downloadTree(rPath, dPath.edit_text))
+            self.notification("Downloading {}/".format('/'.join(rPath)))
 
         self.return_to_main()
 
@@ -415,7 +691,18 @@ class UserInterface(SessionsHandler):
 
         # Remove current transfer from pile_widget but don't delete other widgets
         pile_widget.contents[:] = [x for x in pile_widget.contents
-            if type(x[0]) != CustomColumns or x[0].info['sFile'] != sFile]
+            if type(x[0]) != CustomColumns or x[0].info.get('sFile') != sFile]
+        pile_widget.focus_position = 0
+
+
+    def resume_batch_in_loop(self, pile_widget, batchName, resume, key):
+        if resume:
+            self.loop.create_task(self.resumeBatch(batchName))
+        else:
+            self.deleteBatch(batchName)
+
+        pile_widget.contents[:] = [x for x in pile_widget.contents
+            if type(x[0]) != CustomColumns or x[0].info.get('batch') != batchName]
         pile_widget.focus_position = 0
 
 
@@ -429,8 +716,13 @@ class UserInterface(SessionsHandler):
         self.return_to_main()
 
 
+    def delete_tree_in_loop(self, rPath, key):
+        self.loop.create_task(self.deleteTree(rPath))
+        self.return_to_main()
+
+
     def cancel_in_loop(self, sFile, size, rPath, key):
-        if size <= self.chunkSize: # no chunks
+        if self.tHandler[sFile].now_transmitting != 2: # no chunks
             self.notification("Can't cancel single chunk transfers")
         elif self.tHandler[sFile].should_stop:
             self.notification("Transfer already cancelled")
@@ -439,6 +731,187 @@ class UserInterface(SessionsHandler):
             self.notification("Transfer {} cancelled".format('/'.join(rPath)))
 
 
+def run_and_end(handler: SessionsHandler, coro):
+    # runs coro and then stops the threads of handler
+    loop = asyncio.get_event_loop()
+
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.run_until_complete(handler.endSessions())
+
+
+def cat_file(rPath: str) -> int:
+    """
+    Writes the contents of the uploaded file rPath to stdout without
+    saving it on disk, so it can be piped into other programs
+    """
+
+    handler = SessionsHandler(False if (len(sys.argv) > 1 and sys.argv[1] == '1') else True)
+
+    fileData = handler.findFile(rPath.split('/'))
+    if not fileData:
+        print("There is no uploaded file {}".format(rPath), file=sys.stderr)
+        return 1
+
+    async def write_stream():
+        chunks = handler.stream(fileData)
+        try:
+            async for data in chunks:
+                sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        finally: # frees the session if the reader went away
+            await chunks.aclose()
+
+    try:
+        run_and_end(handler, write_stream())
+    except BrokenPipeError:
+        # the reader exited before the end, like head does. stdout is
+        # pointed to devnull so flushing it at exit doesn't fail again
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+    return 0
+
+
+def put_file(rPath: str) -> int:
+    """
+    Uploads everything read from stdin as rPath, the data is never
+    saved on disk as a whole so the output of other programs can be
+    piped in directly
+    """
+
+    handler = SessionsHandler(False if (len(sys.argv) > 1 and sys.argv[1] == '1') else True)
+
+    try:
+        finalData = run_and_end(handler,
+                                handler.uploadStream(rPath.split('/'), sys.stdin.buffer))
+    except ValueError as e: # nothing was read from stdin
+        print(e, file=sys.stderr)
+        return 1
+
+    if not finalData:
+        print("Upload of {} was cancelled".format(rPath), file=sys.stderr)
+        return 1
+
+    print("Uploaded {} - {}".format(rPath, bytesConvert(finalData['fileData']['size'])),
+          file=sys.stderr)
+    return 0
+
+
+def sync_directory(localPath: str, rPath: str) -> int:
+    """
+    Uploads the files of localPath that changed since the last sync,
+    meant to be run periodically, for example by cron
+    """
+
+    handler = SessionsHandler(False if (len(sys.argv) > 1 and sys.argv[1] == '1') else True)
+
+    if not os.path.isdir(localPath):
+        print("There is no directory {}".format(localPath), file=sys.stderr)
+        return 1
+
+    result = run_and_end(handler,
+                         handler.syncDirectory(localPath, rPath.split('/') if rPath else []))
+
+    print("Scanned {scanned} files, {changed} changed, {uploaded} uploaded, "
+          "{failed} failed".format(**result), file=sys.stderr)
+    return 1 if result['failed'] else 0
+
+
+def scrub_database(repair: bool, repairOrphans: bool) -> int:
+    """
+    Checks that the messages of every file still exist, with repair
+    files with missing chunks are deleted and with repairOrphans so are
+    messages not in the database that are older than orphan_age
+    """
+
+    handler = SessionsHandler(False if (len(sys.argv) > 1 and sys.argv[1] == '1') else True)
+
+    result = run_and_end(handler, handler.scrub(repair, True, repairOrphans))
+
+    for i in result['missing']:
+        print("Missing chunk: {}".format('/'.join(i)))
+    for i in result['wrongSize']:
+        print("Wrong size: {}".format('/'.join(i)))
+    for channel, ID in result['orphans']:
+        print("Orphan: message {} in {}".format(ID, channel))
+
+    print("Checked {} chunks".format(result['checked']), file=sys.stderr)
+    return 1 if result['missing'] or result['wrongSize'] or result['orphans'] else 0
+
+
+def replicate_database() -> int:
+    """
+    Sends the changes of the database to the first channel
+    """
+
+    handler = SessionsHandler(False if (len(sys.argv) > 1 and sys.argv[1] == '1') else True)
+
+    try:
+        result = run_and_end(handler, handler.replicateCatalog())
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    print("Database replicated: {}".format(result), file=sys.stderr)
+    return 0
+
+
+def restore_database(force: bool) -> int:
+    """
+    Rebuilds the database from the copy replicated in the first channel
+    """
+
+    handler = SessionsHandler(False if (len(sys.argv) > 1 and sys.argv[1] == '1') else True)
+
+    try:
+        files = run_and_end(handler, handler.restoreCatalog(force))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    print("Restored {} files".format(files), file=sys.stderr)
+    return 0
+
+
 if __name__ == "__main__":
-    ui = UserInterface()
-    ui.urwid_loop.run()
+    # cli.py [1] [--profile] [cat|put <rPath> | sync <localPath> <rPath>
+    #                         | scrub [repair [orphans]]
+    #                         | replicate | restore [force]]
+    profiler = None
+    if '--profile' in sys.argv:
+        # removed so the sys.argv[1] checks still work
+        sys.argv.remove('--profile')
+
+        from backend.profiler import Profiler
+        import time
+        profiler = Profiler("tgFileManager_profile_{}".format(time.strftime("%Y%m%d_%H%M%S")))
+        profiler.start()
+
+    args = sys.argv[2:] if (len(sys.argv) > 1 and sys.argv[1] == '1') else sys.argv[1:]
+    status = 0
+
+    try:
+        if len(args) == 2 and args[0] == 'cat':
+            status = cat_file(args[1])
+        elif len(args) == 2 and args[0] == 'put':
+            status = put_file(args[1])
+        elif len(args) == 3 and args[0] == 'sync':
+            status = sync_directory(args[1], args[2])
+        elif args and args[0] == 'scrub':
+            status = scrub_database('repair' in args[1:], args[1:] == ['repair', 'orphans'])
+        elif args == ['replicate']:
+            status = replicate_database()
+        elif args and args[0] == 'restore':
+            status = restore_database(args[1:] == ['force'])
+        else:
+            ui = UserInterface()
+            try:
+                ui.urwid_loop.run()
+            finally:
+                ui.loop.run_until_complete(ui.endSessions())
+    finally:
+        if profiler:
+            print("Profile saved to {} and {}".format(*profiler.stop()), file=sys.stderr)
+
+    sys.exit(status)
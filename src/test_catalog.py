@@ -0,0 +1,170 @@
+# Tests of CatalogEntry, the entries of fileDatabase. Run with make unittest
+
+from operator import itemgetter
+import tracemalloc
+import unittest
+import pickle
+import gc
+import os
+
+from backend.catalog import CatalogEntry, _shared
+from backend.fileTree import FileTree
+from backend.fingerprint import FINGERPRINT_SIZE
+
+
+def rows(n: int):
+    # files in a directory layout like the one of a synced photo library,
+    # 100 files per directory
+    for i in range(n):
+        yield {'rPath'        : ['home', 'user', 'dir{}'.format(i // 100),
+                                 'file{}.jpg'.format(i)],
+               'fileID'       : [100000 + i],
+               'size'         : 123456 + i,
+               'channels'     : ['me'],
+               'fingerprints' : [os.urandom(FINGERPRINT_SIZE)]}
+
+
+def bytesPerEntry(make: callable, n: int = 20000) -> float:
+    gc.collect()
+    tracemalloc.start()
+    fileDatabase = [make(i) for i in rows(n)]
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return used / n
+
+
+class TestCatalogEntry(unittest.TestCase):
+    def entry(self, name: str = 'c', fileID: list = (1, 2)) -> CatalogEntry:
+        return CatalogEntry({'rPath'        : ['a', 'b', name],
+                             'fileID'       : list(fileID),
+                             'size'         : 3000,
+                             'channels'     : ['me'] * len(fileID),
+                             'fingerprints' : [bytes([i]) * FINGERPRINT_SIZE for i in fileID],
+                             'chunkSize'    : 2000})
+
+
+    def test_memory(self):
+        # the figure given for CatalogEntry, about 700 bytes per entry
+        # as dictionaries and 350 as entries
+        dicts = bytesPerEntry(lambda x: x)
+        entries = bytesPerEntry(CatalogEntry)
+
+        self.assertLess(entries, 400)
+        self.assertLess(entries, dicts / 2)
+
+
+    def test_fields(self):
+        e = self.entry()
+
+        self.assertEqual(e['rPath'], ('a', 'b', 'c'))
+        self.assertEqual(e['fileID'], (1, 2))
+        self.assertEqual(self.entry(fileID=[7])['fileID'], (7,))
+        self.assertEqual(e['channels'], ('me', 'me'))
+        self.assertEqual(e['fingerprints'], (b'\x01' * 16, b'\x02' * 16))
+        self.assertEqual(e['size'], 3000)
+
+        # optional fields that aren't set behave like missing keys
+        self.assertTrue('channels' in e)
+        self.assertFalse('key' in e)
+        self.assertIsNone(e.get('key'))
+        self.assertEqual(e.get('iv', b''), b'')
+        with self.assertRaises(KeyError):
+            e['key']
+        with self.assertRaises(KeyError):
+            e['path'] = 'x'
+
+
+    def test_mutation(self):
+        # changing a returned value in place raises instead of being lost
+        e = self.entry()
+
+        with self.assertRaises(AttributeError):
+            e['fileID'].append(3)
+        with self.assertRaises(TypeError):
+            e['rPath'][-1] = 'd'
+        with self.assertRaises(AttributeError):
+            e['fingerprints'].append(b'')
+
+        e['fileID'] = [5]
+        e['rPath'] = ['x', 'y']
+        self.assertEqual((e['fileID'], e['rPath']), ((5,), ('x', 'y')))
+
+
+    def test_equality(self):
+        # fileDatabase.remove and index compare by value like dictionaries
+        a, b = self.entry(), self.entry()
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, self.entry('d'))
+        self.assertNotEqual(a, self.entry(fileID=[1, 3]))
+        self.assertNotEqual(a, {'rPath': ['a', 'b', 'c']})
+
+        fileDatabase = [self.entry('d'), a]
+        self.assertEqual(fileDatabase.index(b), 1)
+        fileDatabase.remove(b)
+        self.assertEqual(fileDatabase, [self.entry('d')])
+
+        with self.assertRaises(TypeError):
+            hash(a)
+
+
+    def test_sharing(self):
+        a, b = self.entry('c'), self.entry('d')
+        self.assertIs(a.dir, b.dir)
+        self.assertIs(a.channels, b.channels)
+
+        key = ('a', 'b')
+        self.assertIn(key, _shared)
+        del a, b
+        gc.collect()
+        self.assertNotIn(key, _shared)
+
+
+    def test_pickle(self):
+        # fileIO saves fileDatabase with pickle
+        a = self.entry()
+        b = pickle.loads(pickle.dumps(a))
+        self.assertEqual(a, b)
+        self.assertIs(a.dir, b.dir)
+
+        # entries saved before fingerprints and chunkSize existed
+        old = CatalogEntry.__new__(CatalogEntry)
+        old.__setstate__((('a', 'b'), 'c', 9, 10, None, None, ('me',)))
+        self.assertEqual(old['rPath'], ('a', 'b', 'c'))
+        self.assertFalse('fingerprints' in old or 'chunkSize' in old)
+        self.assertIs(old.dir, a.dir)
+
+
+    def test_database_operations(self):
+        # what SessionsHandler and the download widget do with the entries
+        fileDatabase = [self.entry(i) for i in ('z', 'c', 'm')]
+        fileDatabase.append(CatalogEntry({'rPath': ['a', 'e', 'f'], 'fileID': [9],
+                                          'size': 10}))
+        fileDatabase.sort(key=itemgetter('rPath'))
+        self.assertEqual(['/'.join(i['rPath']) for i in fileDatabase],
+                         ['a/b/c', 'a/b/m', 'a/b/z', 'a/e/f'])
+
+        tree = FileTree(fileDatabase)
+        node = tree.find(['a', 'b'])
+        self.assertEqual((node.count, node.size, tree.root.size), (3, 9000, 9010))
+        # the order of the files in the download widget
+        self.assertEqual(sorted(i['rPath'][-1] for i in node.files), ['c', 'm', 'z'])
+
+        # renameInDatabase
+        entry = fileDatabase[fileDatabase.index(self.entry('m'))]
+        tree.rename(entry, ['a', 'e', 'g'])
+        self.assertIs(tree.find(['a', 'e']).files[-1], entry)
+        self.assertEqual(entry['rPath'], ('a', 'e', 'g'))
+
+        # deleteInDatabase
+        fileDatabase.remove(entry)
+        tree.remove(entry)
+        self.assertEqual((tree.find(['a', 'e']).count, tree.root.count), (1, 3))
+
+        # downloadData
+        self.assertEqual({i: fileDatabase[0][i] for i in ('key', 'iv', 'channels')
+                          if i in fileDatabase[0]}, {'channels': ('me', 'me')})
+
+
+if __name__ == '__main__':
+    unittest.main()
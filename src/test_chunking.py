@@ -0,0 +1,83 @@
+# Tests of the chunk size chosen for new uploads. Run with make unittest
+
+import unittest
+
+from backend.chunking import (ChunkSizer, chunkSize, DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE,
+                              MIN_CHUNK_SIZE, ALIGN, SAVE_EVERY)
+
+MiB = 1024*1024
+
+
+class TestChunkSizer(unittest.TestCase):
+    def test_entry(self):
+        self.assertEqual(chunkSize({'chunkSize': 64*MiB}), 64*MiB)
+        # files uploaded before chunkSize existed
+        self.assertEqual(chunkSize({}), DEFAULT_CHUNK_SIZE)
+        self.assertEqual(chunkSize({'chunkSize': None}), DEFAULT_CHUNK_SIZE)
+
+
+    def test_bounds(self):
+        # a fast link that never fails and one that always does
+        self.assertEqual(ChunkSizer(stats={'throughput': 10**12}).choose(), MAX_CHUNK_SIZE)
+        slow = ChunkSizer(stats={'throughput': 1, 'failures': 10**6})
+        self.assertEqual(slow.choose(), MIN_CHUNK_SIZE)
+
+
+    def test_failures(self):
+        # chunks get smaller when transfers fail
+        sizer = ChunkSizer(stats={'throughput': 100*MiB})
+        before = sizer.choose()
+
+        for _ in range(20):
+            sizer.record(0, 0, failed=True)
+
+        self.assertLess(sizer.choose(), before)
+        self.assertEqual(sizer.choose() % ALIGN, 0)
+
+
+    def test_even(self):
+        # a file a bit bigger than a chunk is split in 2 even chunks
+        sizer = ChunkSizer(100*MiB)
+        self.assertEqual(sizer.choose(), 100*MiB)
+        self.assertEqual(sizer.choose(120*MiB), 60*MiB)
+        self.assertEqual(sizer.choose(10*MiB), 10*MiB)
+        self.assertEqual(sizer.choose(10*MiB + 1), 11*MiB)
+        # streams don't know their size
+        self.assertEqual(sizer.choose(None), 100*MiB)
+
+
+    def test_record(self):
+        sizer = ChunkSizer(stats={'throughput': 10*MiB})
+        sizer.record(20*MiB, 1)
+        self.assertAlmostEqual(sizer.throughput, 12*MiB)
+        self.assertEqual(sizer.bytes, 20*MiB)
+
+        # what isn't a measurement doesn't change the throughput
+        sizer.record(0, 0)
+        self.assertAlmostEqual(sizer.throughput, 12*MiB)
+
+
+    def test_save(self):
+        # the measurements are saved at most once every SAVE_EVERY seconds
+        saved = []
+        sizer = ChunkSizer(save=saved.append)
+
+        for _ in range(10):
+            sizer.record(MiB, 1)
+        self.assertEqual(saved, [])
+
+        sizer.saved -= SAVE_EVERY
+        sizer.record(MiB, 1)
+        self.assertEqual(saved, [sizer.stats()])
+
+        # flush only saves what changed
+        sizer.flush()
+        sizer.record(MiB, 1)
+        sizer.flush()
+        sizer.flush()
+        self.assertEqual(len(saved), 2)
+        self.assertEqual(ChunkSizer(stats=saved[-1]).stats(), sizer.stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
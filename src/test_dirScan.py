@@ -0,0 +1,64 @@
+# Tests of the directory scan used by syncDirectory. Run with make unittest
+
+from tempfile import TemporaryDirectory
+import unittest
+import os
+
+from backend.dirScan import scanDirectory, changedFiles
+
+
+class TestDirScan(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        for i, size in (('a', 1), ('d/b', 2), ('d/e/c', 3)):
+            self.write(i, size)
+
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+    def write(self, relPath: str, size: int):
+        path = os.path.join(self.tmp.name, *relPath.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+
+
+    def test_scan(self):
+        scan = scanDirectory(self.tmp.name)
+
+        self.assertEqual(sorted(scan), ['a', 'd/b', 'd/e/c'])
+        self.assertEqual([scan[i][0] for i in sorted(scan)], [1, 2, 3])
+
+        st = os.stat(os.path.join(self.tmp.name, 'd', 'b'))
+        self.assertEqual(scan['d/b'], (st.st_size, st.st_mtime_ns, st.st_ino))
+
+
+    @unittest.skipUnless(hasattr(os, 'symlink'), "no symlinks")
+    def test_symlinks(self):
+        # symlinks aren't followed, to files or to directories
+        os.symlink(os.path.join(self.tmp.name, 'a'), os.path.join(self.tmp.name, 'l'))
+        os.symlink(os.path.join(self.tmp.name, 'd'), os.path.join(self.tmp.name, 'ld'))
+
+        self.assertEqual(sorted(scanDirectory(self.tmp.name)), ['a', 'd/b', 'd/e/c'])
+
+
+    def test_changed(self):
+        cache = scanDirectory(self.tmp.name)
+        self.assertEqual(changedFiles(cache, cache), [])
+        self.assertEqual(sorted(changedFiles(cache, {})), ['a', 'd/b', 'd/e/c'])
+
+        scan = dict(cache)
+        scan['a'] = (5,) + cache['a'][1:]
+        scan['d/b'] = cache['d/b'][:1] + (cache['d/b'][1] + 1, cache['d/b'][2])
+        scan['d/e/c'] = cache['d/e/c'][:2] + (cache['d/e/c'][2] + 1,)
+        scan['n'] = (1, 1, 1)
+
+        self.assertEqual(sorted(changedFiles(scan, cache)), ['a', 'd/b', 'n'])
+        # the inode only counts when it's asked for
+        self.assertEqual(sorted(changedFiles(scan, cache, True)), ['a', 'd/b', 'd/e/c', 'n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
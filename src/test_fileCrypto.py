@@ -0,0 +1,94 @@
+# Tests of the AES-256-CTR encryption of files. Run with make unittest
+
+from tempfile import TemporaryDirectory
+import unittest
+import asyncio
+import os
+
+from backend.fileCrypto import FileCrypto, newKey, ctr, BLOCK_SIZE
+from backend.fingerprint import fingerprint, newHash
+
+
+class TestCtr(unittest.TestCase):
+    def setUp(self):
+        self.key, self.iv = newKey()
+        self.data = os.urandom(10*BLOCK_SIZE + 5)
+        self.encrypted = ctr(self.data, self.key, self.iv, 0)
+
+
+    def test_roundtrip(self):
+        self.assertEqual(len(self.encrypted), len(self.data))
+        self.assertNotEqual(self.encrypted, self.data)
+        self.assertEqual(ctr(self.encrypted, self.key, self.iv, 0), self.data)
+
+
+    def test_offsets(self):
+        # any range can be decrypted on its own, also when it doesn't
+        # start at a block boundary
+        for start, end in ((0, 1), (16, 48), (3, 40), (17, 18), (150, 165)):
+            self.assertEqual(ctr(self.encrypted[start:end], self.key, self.iv, start),
+                             self.data[start:end])
+
+
+    def test_counter_wraps(self):
+        iv = b'\xff' * BLOCK_SIZE
+        encrypted = ctr(self.data, self.key, iv, 0)
+        self.assertEqual(ctr(encrypted[40:], self.key, iv, 40), self.data[40:])
+
+
+class TestFileCrypto(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # small buffers so every chunk is read in several parts
+        self.crypto = FileCrypto(2, bufSize=1000)
+
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.crypto.io.close())
+        self.crypto.executor.shutdown()
+        self.loop.close()
+        self.tmp.cleanup()
+
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmp.name, name)
+
+
+    def test_chunks(self):
+        # encrypts a file in chunks like uploadFiles and joins them
+        # like downloadFiles
+        data = os.urandom(10007)
+        with open(self.path('file'), 'wb') as f:
+            f.write(data)
+
+        key, iv = newKey()
+        chunks = []
+        index = 0
+        while True:
+            chunks.append(self.path('chunk{}'.format(len(chunks))))
+            offset = index
+            h = newHash()
+            index = self.loop.run_until_complete(
+                self.crypto.encryptFile(index, self.path('file'), chunks[-1],
+                                        3000, key, iv, h=h))
+            self.assertEqual(os.path.getsize(chunks[-1]),
+                             (index if index else len(data)) - offset)
+            # the fingerprint is of the original data
+            self.assertEqual(h.digest(), fingerprint(self.path('file'), offset, 3000))
+            if not index:
+                break
+
+        self.assertEqual(len(chunks), 4)
+
+        for i, chunk in enumerate(chunks):
+            self.loop.run_until_complete(
+                self.crypto.decryptAppend(chunk, self.path('out'), i*3000, key, iv))
+
+        with open(self.path('out'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+
+if __name__ == '__main__':
+    unittest.main()
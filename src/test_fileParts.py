@@ -0,0 +1,42 @@
+# Tests of the part ranges requested for range downloads, they need
+# pyrogram to be installed. Run with make unittest
+
+import unittest
+import os
+
+try:
+    from backend.fileParts import partRange, cutPart, PART_SIZE
+except ImportError:
+    partRange = None
+
+
+@unittest.skipIf(partRange is None, "pyrogram isn't installed")
+class TestPartRange(unittest.TestCase):
+    def setUp(self):
+        self.document = os.urandom(3*PART_SIZE + 100)
+
+
+    def download(self, start: int, end: int) -> bytes:
+        # what iterRange yields for the range
+        return b''.join(cutPart(self.document[i*PART_SIZE:(i+1)*PART_SIZE], i, start, end)
+                        for i in partRange(start, end))
+
+
+    def test_parts(self):
+        self.assertEqual(list(partRange(0, 1)), [0])
+        self.assertEqual(list(partRange(0, PART_SIZE)), [0])
+        self.assertEqual(list(partRange(PART_SIZE - 1, PART_SIZE + 1)), [0, 1])
+        self.assertEqual(list(partRange(PART_SIZE, 2*PART_SIZE)), [1])
+        self.assertEqual(list(partRange(0, len(self.document))), [0, 1, 2, 3])
+
+
+    def test_cut(self):
+        size = len(self.document)
+        for start, end in ((0, size), (0, 1), (5, PART_SIZE), (PART_SIZE - 1, PART_SIZE + 1),
+                           (PART_SIZE, 2*PART_SIZE), (100, 3*PART_SIZE + 50),
+                           (size - 1, size)):
+            self.assertEqual(self.download(start, end), self.document[start:end])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# Tests of FileTree, the directory tree shown by the UI. Run with make unittest
+
+import unittest
+
+from backend.fileTree import FileTree
+
+
+def entry(rPath: str, size: int) -> dict:
+    return {'rPath': rPath.split('/'), 'size': size}
+
+
+class TestFileTree(unittest.TestCase):
+    def setUp(self):
+        self.files = [entry('a/b/1', 10), entry('a/b/2', 20),
+                      entry('a/c/3', 30), entry('4', 40)]
+        self.tree = FileTree(self.files)
+
+
+    def totals(self, path: str) -> tuple:
+        node = self.tree.find(path.split('/') if path else [])
+        return node.size, node.count
+
+
+    def test_totals(self):
+        self.assertEqual(self.totals(''), (100, 4))
+        self.assertEqual(self.totals('a'), (60, 3))
+        self.assertEqual(self.totals('a/b'), (30, 2))
+        self.assertEqual(self.tree.root.files, [self.files[3]])
+
+
+    def test_find(self):
+        node = self.tree.find(['a', 'c'])
+        self.assertEqual(node.path(), ['a', 'c'])
+        self.assertEqual(self.tree.root.path(), [])
+        self.assertIsNone(self.tree.find(['a', 'x']))
+        # files aren't directories
+        self.assertIsNone(self.tree.find(['4']))
+
+
+    def test_walk(self):
+        # the tree keeps the entries themselves, not copies
+        walked = list(self.tree.find(['a']).walk())
+        self.assertEqual(len(walked), 3)
+        for i in self.files[:3]:
+            self.assertTrue(any(i is j for j in walked))
+
+
+    def test_remove(self):
+        self.tree.remove(self.files[2])
+        self.assertEqual(self.totals(''), (70, 3))
+        # empty directories are removed
+        self.assertNotIn('c', self.tree.find(['a']).dirs)
+
+        self.tree.remove(self.files[0])
+        self.tree.remove(self.files[1])
+        self.assertEqual(list(self.tree.root.dirs), [])
+
+        with self.assertRaises(ValueError):
+            self.tree.remove(entry('x/y', 1))
+
+
+    def test_rename(self):
+        fileData = self.files[0]
+        self.tree.rename(fileData, ['a', 'c', '1'])
+
+        self.assertEqual(fileData['rPath'], ['a', 'c', '1'])
+        self.assertIs(self.tree.find(['a', 'c']).files[-1], fileData)
+        self.assertEqual(self.totals('a/c'), (40, 2))
+        self.assertEqual(self.totals('a/b'), (20, 1))
+        self.assertEqual(self.totals(''), (100, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
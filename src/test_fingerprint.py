@@ -0,0 +1,66 @@
+# Tests of the chunk fingerprints. Run with make unittest
+
+from tempfile import TemporaryDirectory
+import unittest
+import os
+
+from backend.fingerprint import (fingerprint, copyChunk, newHash, FINGERPRINT_SIZE,
+                                 READ_SIZE)
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'file')
+        self.data = os.urandom(2*READ_SIZE + 100)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+
+    def digest(self, data: bytes) -> bytes:
+        h = newHash()
+        h.update(data)
+        return h.digest()
+
+
+    def test_chunks(self):
+        for start, size in ((0, len(self.data)), (0, 10), (READ_SIZE - 5, READ_SIZE + 50)):
+            digest = fingerprint(self.path, start, size)
+            self.assertEqual(len(digest), FINGERPRINT_SIZE)
+            self.assertEqual(digest, self.digest(self.data[start:start+size]))
+
+
+    def test_end_of_file(self):
+        # the last chunk is shorter than the chunk size
+        self.assertEqual(fingerprint(self.path, 2*READ_SIZE, READ_SIZE),
+                         self.digest(self.data[2*READ_SIZE:]))
+
+
+    def test_changed(self):
+        before = fingerprint(self.path, 0, 1000)
+        with open(self.path, 'r+b') as f:
+            f.seek(999)
+            f.write(bytes([self.data[999] ^ 1]))
+
+        self.assertNotEqual(fingerprint(self.path, 0, 1000), before)
+        self.assertEqual(fingerprint(self.path, 1000, 1000), self.digest(self.data[1000:2000]))
+
+
+    def test_copy(self):
+        # the chunks copied by uploadFiles get the same fingerprints
+        out = os.path.join(self.tmp.name, 'chunk')
+        for start, size in ((0, READ_SIZE + 1), (2*READ_SIZE, READ_SIZE)):
+            digest, copied = copyChunk(self.path, out, start, size)
+
+            with open(out, 'rb') as f:
+                self.assertEqual(f.read(), self.data[start:start+size])
+            self.assertEqual(copied, len(self.data[start:start+size]))
+            self.assertEqual(digest, fingerprint(self.path, start, size))
+
+
+if __name__ == '__main__':
+    unittest.main()
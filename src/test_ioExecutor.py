@@ -0,0 +1,99 @@
+# Tests of the queues of the disk threads. Run with make unittest
+
+from tempfile import TemporaryDirectory
+import threading
+import unittest
+import asyncio
+import os
+
+from backend.ioExecutor import IOExecutor, FOREGROUND, BACKGROUND
+
+
+class TestIOExecutor(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.io = IOExecutor(workers=1, queueSize=2)
+
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.io.close())
+        self.loop.close()
+        self.tmp.cleanup()
+
+
+    def run_(self, coro):
+        return self.loop.run_until_complete(coro)
+
+
+    def test_run(self):
+        path = os.path.join(self.tmp.name, 'file')
+        self.assertEqual(self.run_(self.io.run(path, pow, 2, 10)), 1024)
+        self.assertEqual(self.run_(self.io.run(path, int, '10', base=16)), 16)
+
+        with self.assertRaises(ZeroDivisionError):
+            self.run_(self.io.run(path, divmod, 1, 0))
+
+        # files in the same directory are on the same device
+        stats = self.io.stats()
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(list(stats.values())[0]['jobs'], 3)
+
+
+    def test_device(self):
+        # directories that don't exist yet use their closest parent
+        missing = os.path.join(self.tmp.name, 'a', 'b', 'file')
+        self.io.loop = self.loop
+        self.assertEqual(self.run_(self.io.device(missing)), os.stat(self.tmp.name).st_dev)
+        self.assertIn(os.path.dirname(missing), self.io.dirDevices)
+
+
+    def test_priority(self):
+        # foreground jobs are taken before the background ones that wait
+        path = os.path.join(self.tmp.name, 'file')
+        release = threading.Event()
+        order = []
+
+        async def jobs():
+            blocked = asyncio.ensure_future(self.io.run(path, release.wait, priority=FOREGROUND))
+            await asyncio.sleep(0.05) # the only worker is busy
+            queued = [asyncio.ensure_future(self.io.run(path, order.append, i, priority=p))
+                      for i, p in (('b1', BACKGROUND), ('f', FOREGROUND), ('b2', BACKGROUND))]
+            await asyncio.sleep(0.05)
+            release.set()
+            await asyncio.gather(blocked, *queued)
+
+        self.run_(jobs())
+        self.assertEqual(order, ['f', 'b1', 'b2'])
+
+
+    def test_queue_size(self):
+        # at most queueSize background jobs wait, the others wait for a slot
+        path = os.path.join(self.tmp.name, 'file')
+        release = threading.Event()
+
+        async def jobs():
+            tasks = [asyncio.ensure_future(self.io.run(path, release.wait)) for _ in range(4)]
+            await asyncio.sleep(0.05)
+            queued = self.io.stats()
+            release.set()
+            await asyncio.gather(*tasks)
+            return list(queued.values())[0]
+
+        queued = self.run_(jobs())
+        self.assertEqual(queued['running'] + queued['queued'], 2)
+
+
+    def test_close(self):
+        path = os.path.join(self.tmp.name, 'file')
+        self.run_(self.io.run(path, abs, -1))
+        tasks = [task for i in self.io.devices.values() for task in i.tasks]
+
+        self.run_(self.io.close())
+        self.assertEqual(self.io.devices, {})
+        self.assertTrue(all(i.done() for i in tasks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# Tests of the channel chosen for every chunk. Run with make unittest
+
+import unittest
+
+from backend.placement import Placement, parseChannels
+
+
+def entry(sizes: list, channels: list = None, rPath: list = ('a',)) -> dict:
+    fileData = {'rPath': list(rPath), 'fileID': list(range(len(sizes))),
+                'size': sum(sizes), 'chunkSize': sizes[0]}
+    if channels:
+        fileData['channels'] = channels
+
+    return fileData
+
+
+class TestPlacement(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parseChannels('-100123, me,mychannel'),
+                         [-100123, 'me', 'mychannel'])
+
+
+    def test_policy(self):
+        with self.assertRaises(ValueError):
+            Placement(['me'], 'random')
+
+
+    def test_load(self):
+        # chunks without a channel are in the first one, the last chunk
+        # is shorter
+        placement = Placement([1, 2], 'least_loaded',
+                              [entry([100, 100, 50], [1, 2, 2]), entry([30])])
+        self.assertEqual(placement.load, {1: 130, 2: 150})
+
+        placement.remove(entry([100, 100, 50], [1, 2, 2]))
+        self.assertEqual(placement.load, {1: 30, 2: 0})
+
+        # removed channels aren't tracked
+        placement.add(entry([10], [3]))
+        self.assertEqual(placement.load, {1: 30, 2: 0})
+
+
+    def test_round_robin(self):
+        placement = Placement([1, 2, 3], 'round_robin')
+        self.assertEqual([placement.pick(['a'], i) for i in range(5)], [1, 2, 3, 1, 2])
+
+
+    def test_hash(self):
+        placement = Placement([1, 2, 3], 'hash')
+        picked = [placement.pick(['a', str(i)], 0) for i in range(30)]
+
+        self.assertEqual(picked, [placement.pick(['a', str(i)], 0) for i in range(30)])
+        self.assertEqual(set(picked), {1, 2, 3})
+
+
+    def test_reserve(self):
+        # concurrent uploads don't all go to the emptiest channel
+        placement = Placement([1, 2], 'least_loaded')
+        first = placement.pick(['a'], 0, 100)
+        second = placement.pick(['b'], 0, 100)
+        self.assertNotEqual(first, second)
+        self.assertEqual(placement.load, {1: 100, 2: 100})
+
+        # the upload was smaller than expected, the other one failed
+        placement.settle(first, 100, 60)
+        placement.settle(second, 100)
+        self.assertEqual(placement.load, {first: 60, second: 0})
+        self.assertEqual(placement.pick(['c'], 0), second)
+
+
+if __name__ == '__main__':
+    unittest.main()
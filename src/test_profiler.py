@@ -0,0 +1,31 @@
+# Tests that the profiler leaves the loop as it found it. Run with make unittest
+
+from tempfile import TemporaryDirectory
+import unittest
+import asyncio
+import os
+
+from backend.profiler import Profiler
+
+
+class TestProfiler(unittest.TestCase):
+    def test_stop(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        with TemporaryDirectory() as tmp:
+            profiler = Profiler(os.path.join(tmp, 'profile'))
+            profiler.start()
+            loop.run_until_complete(asyncio.sleep(0.2))
+            report, folded = profiler.stop()
+
+            # the sampling tasks finished, nothing is destroyed pending
+            self.assertTrue(all(i.done() for i in profiler.tasks))
+            self.assertTrue(os.path.isfile(report) and os.path.isfile(folded))
+            self.assertNotIn('run_in_executor', vars(loop))
+
+        loop.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+# Replicates a database into a directory with LocalBackend and restores it,
+# doesn't need telegram. Run with make unittest
+
+from tempfile import TemporaryDirectory
+from operator import itemgetter
+import unittest
+import asyncio
+import os
+
+from backend.catalog import CatalogEntry
+from backend.fingerprint import FINGERPRINT_SIZE
+from backend.replication import Replicator, LocalBackend, unpack
+
+
+def entry(rPath: list, fileID: list, encrypted: bool = False) -> CatalogEntry:
+    fileData = {'rPath'        : rPath,
+                'fileID'       : fileID,
+                'size'         : 1000 * len(fileID),
+                'channels'     : ['me'] * len(fileID),
+                'fingerprints' : [os.urandom(FINGERPRINT_SIZE) for _ in fileID],
+                'chunkSize'    : 64*1024*1024}
+    if encrypted:
+        fileData['key'], fileData['iv'] = os.urandom(32), os.urandom(16)
+
+    return CatalogEntry(fileData)
+
+
+def asDicts(fileDatabase: list) -> list:
+    return sorted(({i: fileData[i] for i in CatalogEntry.fields if i in fileData}
+                   for fileData in fileDatabase), key=itemgetter('rPath'))
+
+
+class TestReplication(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.backend = LocalBackend(self.tmp.name)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+
+    def tearDown(self):
+        self.loop.close()
+        self.tmp.cleanup()
+
+
+    def run_(self, coro):
+        return self.loop.run_until_complete(coro)
+
+
+    def replicateChanges(self, passphrase: str = '', encrypted: bool = False):
+        saved = []
+        replicator = Replicator(None, saved.append, passphrase, snapshotDeltas=50)
+        db = [entry(['a', str(i)], [i, i + 100], encrypted) for i in range(1, 50)]
+
+        self.assertEqual(self.run_(replicator.replicate(self.backend, db)), 'snapshot')
+        self.assertEqual(self.run_(replicator.replicate(self.backend, db)), 'unchanged')
+
+        db.append(entry(['b', 'new'], [500], encrypted))
+        self.assertEqual(self.run_(replicator.replicate(self.backend, db)), 'delta')
+
+        db[0]['rPath'] = ['c', 'renamed']
+        del db[1]
+        self.assertEqual(self.run_(replicator.replicate(self.backend, db)), 'delta')
+
+        # only the digests are kept
+        self.assertEqual(len(saved[-1]['digests']), len(db))
+        self.assertEqual(len(replicator.messageIDs()), 3)
+
+        # the delta has only what changed
+        delta = self.run_(self.backend.read(replicator.state['deltas'][-1]))
+        delta = unpack(delta, passphrase)
+        self.assertEqual([i['rPath'] for i in delta['set']], [['c', 'renamed']])
+        self.assertEqual(len(delta['remove']), 2)
+
+        return db
+
+
+    def test_restore(self):
+        db = self.replicateChanges()
+
+        replicator = Replicator()
+        restored = self.run_(replicator.restore(self.backend))
+        self.assertEqual(asDicts(restored), asDicts(db))
+
+        # the restored replica continues with deltas
+        db.append(entry(['d', 'after'], [900]))
+        self.assertEqual(self.run_(replicator.replicate(self.backend, db)), 'delta')
+        restored = self.run_(Replicator().restore(self.backend))
+        self.assertEqual(asDicts(restored), asDicts(db))
+
+
+    def test_passphrase(self):
+        db = self.replicateChanges('secret', encrypted=True)
+
+        restored = self.run_(Replicator(passphrase='secret').restore(self.backend))
+        self.assertEqual(asDicts(restored), asDicts(db))
+
+        with self.assertRaises(ValueError):
+            self.run_(Replicator(passphrase='wrong').restore(self.backend))
+        with self.assertRaises(ValueError):
+            self.run_(Replicator().restore(self.backend))
+
+
+    def test_keys_need_passphrase(self):
+        with self.assertRaises(ValueError):
+            self.run_(Replicator().replicate(self.backend, [entry(['a'], [1], True)]))
+
+
+    def test_snapshot_replaces_deltas(self):
+        replicator = Replicator(snapshotDeltas=2)
+        db = [entry(['a', str(i)], [i]) for i in range(1, 50)]
+        self.run_(replicator.replicate(self.backend, db))
+
+        kinds = []
+        for i in range(3):
+            db.append(entry(['b', str(i)], [1000 + i]))
+            kinds.append(self.run_(replicator.replicate(self.backend, db)))
+
+        self.assertEqual(kinds, ['delta', 'delta', 'snapshot'])
+        self.assertEqual(replicator.state['deltas'], [])
+        # the superseded messages were deleted
+        self.assertEqual(sorted(i for i in os.listdir(self.tmp.name) if i.isdigit()),
+                         [str(replicator.state['snapshot'])])
+
+        restored = self.run_(Replicator().restore(self.backend))
+        self.assertEqual(asDicts(restored), asDicts(db))
+
+
+
+    def test_duplicate_paths(self):
+        # entries with the same rPath and paths that only differ in where
+        # the '/' is are all restored
+        replicator = Replicator()
+        db = [entry(['a', 'b'], [1]), entry(['a', 'b'], [2]), entry(['a/b'], [3]),
+              entry(['a', 'c'], [4])]
+        self.run_(replicator.replicate(self.backend, db))
+
+        db.append(entry(['a', 'b'], [5]))
+        db[3]['fileID'] = [6]
+        self.assertEqual(self.run_(replicator.replicate(self.backend, db)), 'delta')
+
+        restored = self.run_(Replicator().restore(self.backend))
+        self.assertEqual(asDicts(restored), asDicts(db))
+
+
+    def test_tampering(self):
+        self.run_(Replicator(passphrase='secret').replicate(
+            self.backend, [entry(['a'], [1], True)]))
+
+        path = os.path.join(self.tmp.name, '1')
+        with open(path, 'rb') as f:
+            data = bytearray(f.read())
+        data[-1] ^= 1 # the data still decrypts, only the HMAC is wrong
+        with open(path, 'wb') as f:
+            f.write(data)
+
+        with self.assertRaises(ValueError):
+            self.run_(Replicator(passphrase='secret').restore(self.backend))
+
+
+    def test_older_format(self):
+        # a replica of an older format is replaced by a snapshot and its
+        # messages are deleted with it
+        old = {'seq': 3, 'snapshot': 1, 'deltas': [2, 3], 'digests': {}}
+        for i in (1, 2, 3):
+            self.run_(self.backend.send('old', b'TFMC2P'))
+
+        replicator = Replicator(old)
+        self.assertEqual(sorted(replicator.messageIDs()), [1, 2, 3])
+        self.assertEqual(self.run_(replicator.replicate(self.backend, [entry(['a'], [1])])),
+                         'snapshot')
+        self.assertEqual(replicator.messageIDs(), [4])
+        self.assertEqual(sorted(i for i in os.listdir(self.tmp.name) if i.isdigit()), ['4'])
+
+        with self.assertRaises(ValueError):
+            unpack(b'TFMC2P')
+
+
+if __name__ == '__main__':
+    unittest.main()